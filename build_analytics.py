@@ -1,5 +1,6 @@
 # build_analytics.py
 
+import argparse
 import os
 import subprocess
 import sys
@@ -51,7 +52,7 @@ def get_onnx_libs_path():
 # ^^^^^^ --- КОНЕЦ ИЗМЕНЕНИЯ --- ^^^^^^
 
 
-def create_and_build(name, req_file):
+def create_and_build(name, req_file, onedir=False):
     print(f"\n{'='*20} Building: {name.upper()} {'='*20}")
     
     # VVVVVV --- ИЗМЕНЕНИЕ: Используем Python, который запустил этот скрипт --- VVVVVV
@@ -72,15 +73,22 @@ def create_and_build(name, req_file):
 
     print(f"Running PyInstaller for {name}...")
     
+    # --onedir не распаковывает себя во временный каталог при каждом запуске,
+    # поэтому аналитика стартует быстрее; результат — каталог analytics_<name>/ в onedir/
     pyinstaller_command = [
         python_executable, "-m", "PyInstaller",
-        "--noconfirm", "--onefile",
+        "--noconfirm", "--onedir" if onedir else "--onefile",
         f"--name=analytics_{name}",
-        f"--distpath={DIST_PATH}",
+        f"--distpath={DIST_PATH / 'onedir' if onedir else DIST_PATH}",
         f"--add-data={MODEL_FILE}{os.pathsep}.",
         "--hidden-import=numpy.core._multiarray_umath",
     ]
 
+    # Модели под фиксированный размер входа и варианты INT8/FP16 (export_model.py --sizes/--int8/--fp16)
+    for sized_model in sorted(SRC_DIR.glob("yolov8n_*.onnx")):
+        print(f"Adding model variant {sized_model.name}...")
+        pyinstaller_command.append(f"--add-data={sized_model}{os.pathsep}.")
+
     # VVVVVV --- ИЗМЕНЕНИЕ: Используем новую функцию поиска библиотек --- VVVVVV
     onnx_libs_path = get_onnx_libs_path()
     # ^^^^^^ --- КОНЕЦ ИЗМЕНЕНИЯ --- ^^^^^^
@@ -99,6 +107,11 @@ def create_and_build(name, req_file):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the analytics executables with PyInstaller.")
+    parser.add_argument("--onedir", action="store_true",
+                        help="build a directory instead of a single file (no extraction on every start)")
+    args = parser.parse_args()
+
     if not SRC_FILE.exists():
         print(f"Error: Source file not found at {SRC_FILE}")
         sys.exit(1)
@@ -112,7 +125,7 @@ if __name__ == "__main__":
     DIST_PATH.mkdir(parents=True, exist_ok=True)
     
     for name, req_filename in BUILDS.items():
-        create_and_build(name, REQUIREMENTS_DIR / req_filename)
+        create_and_build(name, REQUIREMENTS_DIR / req_filename, onedir=args.onedir)
 
     print(f"\n{'='*20} All builds for {sys.platform} completed! {'='*20}")
     print(f"Executables are located in: {DIST_PATH}")
\ No newline at end of file
@@ -110,13 +110,12 @@
 
             const [recordings, events] = await Promise.all([
                 window.api.getRecordingsForDate({ cameraName: currentCamera.name, date }),
-                window.api.getEventsForDate({ date })
+                // Индексированный запрос: читается только сегмент журнала этой камеры
+                window.api.queryEvents({ date, cameraId: currentCamera.id })
             ]);
             
             recordingsForDay = recordings;
-            allCameraEventsForDay = events
-                .filter(event => event.cameraId === currentCamera.id)
-                .sort((a, b) => b.timestamp - a.timestamp);
+            allCameraEventsForDay = events.sort((a, b) => b.timestamp - a.timestamp);
 
             renderFilters();
             applyFiltersAndRender();
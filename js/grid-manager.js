@@ -15,6 +15,8 @@
         let currentAudioPlayer = null;
 
         let restartAttempts = {};
+        // Камеры, для которых аналитика шлёт рамки 'overlay': только пока открыт живой просмотр
+        let overlayCameras = new Set();
 
         function getActiveLayoutState() {
             const { layouts, activeLayoutId } = stateManager.state;
@@ -112,6 +114,18 @@
                 try { playerData.player.destroy(); } catch (e) {}
             }
             delete localPlayers[id];
+            syncAnalyticsOverlays();
+        }
+
+        function syncAnalyticsOverlays() {
+            const visible = new Set(Object.values(localPlayers).filter(p => p.player).map(p => p.cameraId));
+            visible.forEach(cameraId => {
+                if (!overlayCameras.has(cameraId)) window.api.setAnalyticsOverlay({ cameraId, visible: true });
+            });
+            overlayCameras.forEach(cameraId => {
+                if (!visible.has(cameraId)) window.api.setAnalyticsOverlay({ cameraId, visible: false });
+            });
+            overlayCameras = visible;
         }
 
         function attachControlEvents(cellElement, cellIndex) {
@@ -227,7 +241,7 @@
                         }
                     } else {
                         cellElement.innerHTML = `<span>${App.i18n.t('connecting')}</span>`;
-                        localPlayers[uniqueStreamIdentifier] = { player: null, cell: cellElement };
+                        localPlayers[uniqueStreamIdentifier] = { player: null, cell: cellElement, cameraId: camera.id };
 
                         const result = await window.api.startVideoStream({ credentials: camera, streamId: cellState.streamId });
 
@@ -300,6 +314,7 @@
                     }
                 }
             });
+            syncAnalyticsOverlays();
         }
 
         function toggleFullscreen(cellIndex) {
@@ -396,17 +411,28 @@
                     overlayCanvas.height = videoCanvas.clientHeight;
                 }
                 
+                // С трекером рамки рисуются по сообщениям 'overlay' (несколько раз в секунду), а
+                // objects_detected несёт лишь появившиеся/обновлённые объекты и стёр бы остальные
+                const trackerEvent = result.status === 'objects_detected' && result.objects?.some(obj => obj.event);
+                if (trackerEvent) return;
+
                 const ctx = overlayCanvas.getContext('2d');
-                
-                setTimeout(() => {
+
+                // Рамки гаснут, только если новых сообщений давно нет (аналитика остановилась)
+                clearTimeout(overlayCanvas.clearTimer);
+                overlayCanvas.clearTimer = setTimeout(() => {
                      ctx.clearRect(0, 0, overlayCanvas.width, overlayCanvas.height);
-                }, 1000);
+                }, 3000);
 
                 ctx.clearRect(0, 0, overlayCanvas.width, overlayCanvas.height);
 
-                if (result.status === 'objects_detected' && result.objects) {
-                    const scaleX = overlayCanvas.width / videoCanvas.width;
-                    const scaleY = overlayCanvas.height / videoCanvas.height;
+                if ((result.status === 'objects_detected' || result.status === 'overlay') && result.objects) {
+                    // Рамки приходят в координатах кадра, который анализировался (он может быть
+                    // SD-потоком или уменьшенным в декодере), а не кадра плеера
+                    const frameWidth = result.frame?.w || videoCanvas.width;
+                    const frameHeight = result.frame?.h || videoCanvas.height;
+                    const scaleX = overlayCanvas.width / frameWidth;
+                    const scaleY = overlayCanvas.height / frameHeight;
 
                     result.objects.forEach(obj => {
                         const x = obj.box.x * scaleX;
@@ -436,6 +462,7 @@
             if (localPlayers[uniqueStreamIdentifier]) {
                 const playerInfo = localPlayers[uniqueStreamIdentifier];
                 delete localPlayers[uniqueStreamIdentifier]; 
+                syncAnalyticsOverlays();
                 
                 restartAttempts[uniqueStreamIdentifier] = (restartAttempts[uniqueStreamIdentifier] || 0) + 1;
                 
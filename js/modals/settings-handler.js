@@ -259,12 +259,20 @@
             // VVVVVV --- ИЗМЕНЕНИЕ: ЗАГРУЗКА НОВОЙ НАСТРОЙКИ --- VVVVVV
             analyticsProviderSelect.value = appSettings.analytics_provider || 'auto';
             // ^^^^^^ --- КОНЕЦ ИЗМЕНЕНИЯ --- ^^^^^^
+            setFormValue('app-settings-analytics-precision', appSettings.analytics_model_precision, 'auto');
             setFormValue('app-settings-notifications-enabled', appSettings.notifications_enabled, true);
             setFormValue('app-settings-qscale', appSettings.qscale, 8);
             setFormValue('app-settings-fps', appSettings.fps, 20);
             
             setFormValue('app-settings-analytics-resize-width', appSettings.analytics_resize_width, 416);
             setFormValue('app-settings-analytics-frame-skip', appSettings.analytics_frame_skip, 10);
+            setFormValue('app-settings-analytics-preroll-seconds', appSettings.analytics_preroll_seconds, 0);
+            setFormValue('app-settings-analytics-stream', appSettings.analytics_stream, 'main');
+            setFormValue('app-settings-analytics-capture-backend', appSettings.analytics_capture_backend, 'opencv');
+            setFormValue('app-settings-analytics-keyframes-only', appSettings.analytics_keyframes_only, false);
+            setFormValue('app-settings-analytics-shared-ingest', appSettings.analytics_shared_ingest, false);
+            setFormValue('app-settings-analytics-snapshots', appSettings.analytics_snapshots, false);
+            setFormValue('app-settings-analytics-motion-gate', appSettings.analytics_motion_gate, false);
             setFormValue('app-settings-analytics-record-duration', appSettings.analytics_record_duration, 30);
             
             document.getElementById('global-analytics-settings').style.display = isGeneralSettings ? 'block' : 'none';
@@ -342,11 +350,19 @@
                     // VVVVVV --- ИЗМЕНЕНИЕ: СОХРАНЕНИЕ НОВОЙ НАСТРОЙКИ --- VVVVVV
                     analytics_provider: analyticsProviderSelect.value,
                     // ^^^^^^ --- КОНЕЦ ИЗМЕНЕНИЯ --- ^^^^^^
+                    analytics_model_precision: document.getElementById('app-settings-analytics-precision').value,
                     notifications_enabled: notificationsEnabledInput.checked,
                     qscale: parseInt(qscaleInput.value, 10) || 8,
                     fps: parseInt(fpsInput.value, 10) || 20,
                     analytics_resize_width: parseInt(globalAnalyticsResizeWidthInput.value, 10) || 416,
                     analytics_frame_skip: parseInt(globalAnalyticsFrameSkipInput.value, 10) || 10,
+                    analytics_preroll_seconds: parseInt(document.getElementById('app-settings-analytics-preroll-seconds').value, 10) || 0,
+                    analytics_stream: document.getElementById('app-settings-analytics-stream').value,
+                    analytics_capture_backend: document.getElementById('app-settings-analytics-capture-backend').value,
+                    analytics_keyframes_only: document.getElementById('app-settings-analytics-keyframes-only').checked,
+                    analytics_shared_ingest: document.getElementById('app-settings-analytics-shared-ingest').checked,
+                    analytics_snapshots: document.getElementById('app-settings-analytics-snapshots').checked,
+                    analytics_motion_gate: document.getElementById('app-settings-analytics-motion-gate').checked,
                     analytics_record_duration: parseInt(document.getElementById('app-settings-analytics-record-duration').value, 10) || 30,
                 });
                 utils.showToast(App.i18n.t('app_settings_saved_success'));
@@ -375,10 +391,11 @@
                     else utils.showToast(`${App.i18n.t('save_settings_error')}: ${result.error}`, true, 5000);
                 }
 
+                // roi и zones в форме не редактируются (задаются только в конфигурации камеры) — сохраняем их как есть
                 const analyticsConfig = {
+                    ...camera.analyticsConfig,
                     enabled: document.getElementById('analytics.enabled').checked,
                     objects: [],
-                    roi: camera.analyticsConfig?.roi || null,
                 };
                 analyticsObjectsListEl.querySelectorAll('input[type="checkbox"]:checked').forEach(checkbox => {
                     analyticsConfig.objects.push(checkbox.dataset.objectKey);
@@ -390,6 +407,8 @@
                                                   
                 if (analyticsProcessRunning && !analyticsConfig.enabled) {
                     window.api.toggleAnalytics(settingsCameraId);
+                } else if (analyticsProcessRunning) {
+                    window.api.updateAnalyticsConfig({ cameraId: settingsCameraId, analyticsConfig });
                 }
             }
             saveSettingsBtn.disabled = false;
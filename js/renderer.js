@@ -355,13 +355,31 @@
             const btn = document.getElementById(`analytics-btn-${cameraId}`);
             if (btn) btn.classList.toggle('active', active);
         });
-        window.api.onAnalyticsProviderInfo(({ cameraId, provider, error }) => {
+        window.api.onAnalyticsStats(({ cameraId, result }) => {
+            if (result.status !== 'metrics') return;
+            const btn = document.getElementById(`analytics-btn-${cameraId}`);
+            if (!btn) return;
+            const { counters = {}, stages = {} } = result;
+            btn.title = App.t('analytics_stats_tooltip', {
+                fps: result.effective_fps,
+                inference: stages.inference ? stages.inference.p50_ms : '—',
+                dropped: counters.frames_dropped || 0,
+                skipped: (counters.frames_skipped || 0) + (counters.motion_skipped || 0),
+                reconnects: counters.reconnects || 0,
+            });
+        });
+        window.api.onAnalyticsProviderInfo(({ cameraId, result }) => {
+            const { provider, error, warning } = result;
             const camera = App.stateManager.state.cameras.find(c => c.id === cameraId);
             const cameraName = camera ? camera.name : `ID ${cameraId}`;
             if (error) {
                 App.modalHandler.showToast(`Ошибка аналитики для "${cameraName}": ${error}`, true, 6000);
                 return;
             }
+            if (warning) {
+                App.modalHandler.showToast(`Аналитика для "${cameraName}": ${warning}`, true, 6000);
+                return;
+            }
             if (provider) {
                 const isGpu = provider.includes('CUDA') || provider.includes('Dml');
                 const message = isGpu
@@ -49,9 +49,12 @@ contextBridge.exposeInMainWorld('api', {
 
     // Video Analytics
     toggleAnalytics: (cameraId) => ipcRenderer.invoke('toggle-analytics', cameraId),
+    updateAnalyticsConfig: (data) => ipcRenderer.invoke('update-analytics-config', data),
+    setAnalyticsOverlay: (data) => ipcRenderer.invoke('set-analytics-overlay', data),
     onAnalyticsUpdate: (callback) => ipcRenderer.on('analytics-update', (event, data) => callback(data)),
     onAnalyticsStatusChange: (callback) => ipcRenderer.on('analytics-status-change', (event, data) => callback(data)),
     onAnalyticsProviderInfo: (callback) => ipcRenderer.on('analytics-provider-info', (event, data) => callback(data)),
+    onAnalyticsStats: (callback) => ipcRenderer.on('analytics-stats', (event, data) => callback(data)),
 
     // Recording & Archive
     startRecording: (camera) => ipcRenderer.invoke('start-recording', camera),
@@ -60,7 +63,11 @@ contextBridge.exposeInMainWorld('api', {
     openRecordingsFolder: () => ipcRenderer.invoke('open-recordings-folder'),
     getRecordingsForDate: (data) => ipcRenderer.invoke('get-recordings-for-date', data),
     exportArchiveClip: (data) => ipcRenderer.invoke('export-archive-clip', data),
+    analyzeArchive: (data) => ipcRenderer.invoke('analyze-archive', data),
+    getArchiveDetections: (data) => ipcRenderer.invoke('get-archive-detections', data),
+    onArchiveAnalysisProgress: (callback) => ipcRenderer.on('archive-analysis-progress', (event, data) => callback(data)),
     getEventsForDate: (data) => ipcRenderer.invoke('get-events-for-date', data),
+    queryEvents: (data) => ipcRenderer.invoke('query-events', data),
     getDatesWithActivity: (cameraName) => ipcRenderer.invoke('get-dates-with-activity', cameraName),
 
     // System & Events
@@ -5,7 +5,22 @@ import os
 import json
 import time
 import base64
+import calendar
+import collections
+import cProfile
+import pstats
+import queue
+import socket
+import struct
+import subprocess
 import threading
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Отсчёт time-to-ready: до тяжёлых импортов cv2/numpy/onnxruntime
+PROCESS_STARTED = time.monotonic()
 
 if getattr(sys, 'frozen', False):
     application_path = sys._MEIPASS
@@ -42,27 +57,691 @@ class FrameGrabber:
         self.stream = cv2.VideoCapture(src)
         if not self.stream.isOpened():
             raise IOError("Cannot open video stream")
-        self.ret, self.frame = self.stream.read()
+        self.init_state(*self.stream.read())
+    def init_state(self, ret, frame):
+        self.condition = threading.Condition()
+        self.ret, self.frame = ret, frame
+        # Номер кадра и момент захвата: потребитель видит, новый ли это кадр и насколько он свежий
+        self.seq = 1 if ret else 0
+        self.timestamp = time.monotonic()
         self.stopped = False
+        self.metrics = None
+        self.on_frame = None  # вызывается в потоке захвата для каждого кадра (PreRollBuffer.add)
         self.thread = threading.Thread(target=self.update, args=())
         self.thread.daemon = True
     def start(self):
         self.stopped = False
         self.thread.start()
+    def grab(self):
+        return self.stream.read()
     def update(self):
         while not self.stopped:
-            ret, frame = self.stream.read()
+            started = time.perf_counter()
+            ret, frame = self.grab()
             if not ret:
                 self.stop()
                 break
-            self.ret, self.frame = ret, frame
+            if self.metrics is not None:
+                self.metrics.record('grab', time.perf_counter() - started)
+                self.metrics.count('frames_grabbed')
+            with self.condition:
+                self.ret, self.frame = ret, frame
+                self.seq += 1
+                self.timestamp = time.monotonic()
+                self.condition.notify_all()
+            if self.on_frame is not None:
+                self.on_frame(frame)
     def read(self):
         return self.ret, self.frame
+    def read_next(self, last_seq, timeout=1.0):
+        """Waits for a frame newer than last_seq; returns (frame, seq, timestamp) or None."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > last_seq or self.stopped, timeout)
+            if self.seq <= last_seq or self.frame is None:
+                return None
+            return self.frame, self.seq, self.timestamp
+    def release(self):
+        self.stream.release()
     def stop(self):
         self.stopped = True
-        if self.thread.is_alive():
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
             self.thread.join(timeout=1.0)
-        self.stream.release()
+        self.release()
+
+class FfmpegFrameGrabber(FrameGrabber):
+    """Decodes the stream in an ffmpeg subprocess, scaled to the model input size by ffmpeg.
+
+    Frames arrive as YUV4MPEG (its header carries the scaled size) and are converted
+    to BGR into one of three reused buffers. With keyframes_only the decoder skips
+    every non-key frame (-skip_frame nokey), so decode cost follows the GOP rate, and
+    CameraWorker analyzes every keyframe instead of applying frame_skip.
+    """
+    BUFFER_COUNT = 3
+
+    def __init__(self, src, width, height, keyframes_only=False, ffmpeg_path='ffmpeg'):
+        command = [ffmpeg_path, '-nostdin', '-loglevel', 'error']
+        if str(src).startswith('rtsp://'):
+            command += ['-rtsp_transport', 'tcp']
+        if keyframes_only:
+            command += ['-skip_frame', 'nokey']
+        command += ['-i', str(src), '-an', '-sn',
+                    '-vf', f'scale={width}:{height}:force_original_aspect_ratio=decrease:force_divisible_by=2',
+                    '-pix_fmt', 'yuv420p']
+        if keyframes_only:
+            command += ['-vsync', '0']
+        command += ['-f', 'yuv4mpegpipe', '-']
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, bufsize=0)
+        except OSError as e:
+            raise IOError(f"Cannot start ffmpeg: {e}")
+        try:
+            self.open_y4m(self.process.stdout)
+        except IOError:
+            self.process.kill()
+            raise
+
+    def open_y4m(self, stream):
+        self.stdout = stream
+        header = self.stdout.readline().split()
+        if not header or header[0] != b'YUV4MPEG2':
+            raise IOError("Cannot open video stream")
+        params = {token[:1]: token[1:] for token in header[1:]}
+        self.width, self.height = int(params[b'W']), int(params[b'H'])
+        self.yuv = np.empty((self.height * 3 // 2, self.width), dtype=np.uint8)
+        self.yuv_view = memoryview(self.yuv).cast('B')
+        self.buffers = [np.empty((self.height, self.width, 3), dtype=np.uint8) for _ in range(self.BUFFER_COUNT)]
+        self.latest_index = None
+        self.in_use_index = None
+        self.condition = threading.Condition()  # grab() берёт её уже для первого кадра
+        self.init_state(*self.grab())
+
+    def grab(self):
+        marker = self.stdout.readline()
+        if not marker.startswith(b'FRAME'):
+            return False, None
+        received, total = 0, len(self.yuv_view)
+        while received < total:
+            chunk = self.stdout.readinto(self.yuv_view[received:])
+            if not chunk:
+                return False, None
+            received += chunk
+        # Пишем в буфер, который сейчас не опубликован и не занят потребителем
+        with self.condition:
+            index = next(i for i in range(self.BUFFER_COUNT) if i not in (self.latest_index, self.in_use_index))
+        cv2.cvtColor(self.yuv, cv2.COLOR_YUV2BGR_I420, dst=self.buffers[index])
+        self.latest_index = index
+        return True, self.buffers[index]
+
+    def read_next(self, last_seq, timeout=1.0):
+        # Кадр и отметка «занят» — под одной блокировкой: иначе grab() успел бы
+        # перезаписать этот буфер между ними
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > last_seq or self.stopped, timeout)
+            if self.seq <= last_seq or self.frame is None:
+                return None
+            self.in_use_index = next(i for i, b in enumerate(self.buffers) if b is self.frame)
+            return self.frame, self.seq, self.timestamp
+
+    def release(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+class IngestFrameGrabber(FfmpegFrameGrabber):
+    """Reads the frames the dashboard's live-view ffmpeg already decodes (shared ingest).
+
+    Electron tees a downscaled YUV4MPEG copy of the live stream to a per-camera local
+    socket (named pipe on Windows) and drops whole frames while we lag, so the camera
+    serves one RTSP session and the stream is decoded once. A closed endpoint ends the
+    stream like a camera disconnect; CameraWorker then pulls the camera itself.
+    """
+    def __init__(self, ingest_path):
+        try:
+            stream = open_ipc_endpoint(ingest_path, 'rb')
+        except OSError as e:
+            raise IOError(f"Cannot open ingest {ingest_path}: {e}")
+        try:
+            self.open_y4m(stream)
+        except (IOError, OSError):
+            stream.close()
+            raise IOError("Cannot open video stream")
+
+    def release(self):
+        self.stdout.close()
+
+class PreRollBuffer:
+    """Bounded ring of the last seconds of video, kept as downscaled JPEG frames.
+
+    The capture thread adds frames at up to `fps`; entries older than `seconds` or
+    beyond `max_bytes` are dropped, so memory stays capped whatever the stream. On a
+    detection flush() has ffmpeg encode the buffered frames to an H.264 MP4 in a
+    background thread, which covers the seconds the recorder loses connecting to the
+    camera.
+    """
+    def __init__(self, seconds=5.0, fps=10.0, max_bytes=32 * 1024 * 1024, width=640, quality=70,
+                 ffmpeg_path='ffmpeg'):
+        self.seconds = float(seconds)
+        self.ffmpeg_path = ffmpeg_path
+        self.fps = float(fps)
+        self.max_bytes = int(max_bytes)
+        self.width = int(width)
+        self.quality = int(quality)
+        self.frames = collections.deque()  # (время по часам, JPEG)
+        self.bytes = 0
+        self.last_added = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, frame):
+        now = time.time()
+        if now - self.last_added < 1.0 / self.fps:
+            return
+        self.last_added = now
+        height, width = frame.shape[:2]
+        if width > self.width:
+            # Чётные размеры — требование большинства кодеков
+            frame = cv2.resize(frame, (self.width // 2 * 2, int(height * self.width / width) // 2 * 2),
+                               interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return
+        data = jpeg.tobytes()
+        with self.lock:
+            self.frames.append((now, data))
+            self.bytes += len(data)
+            while self.frames and (self.bytes > self.max_bytes or now - self.frames[0][0] > self.seconds):
+                self.bytes -= len(self.frames.popleft()[1])
+
+    def flush(self, directory, prefix, on_done):
+        """Starts writing the buffered frames to <directory>/<prefix>-<start time>.mp4; False if too few."""
+        with self.lock:
+            frames = list(self.frames)
+        if len(frames) < 2:
+            return False
+        # Имя как у записей Electron: архив подхватит клип по дате и времени начала
+        start = time.strftime('%Y-%m-%dT%H-%M-%S', time.localtime(frames[0][0]))
+        path = os.path.join(directory, f'{prefix}-{start}.mp4')
+        threading.Thread(target=self.write_clip, args=(frames, path, on_done), daemon=True).start()
+        return True
+
+    def write_clip(self, frames, path, on_done):
+        first = cv2.imdecode(np.frombuffer(frames[0][1], dtype=np.uint8), cv2.IMREAD_COLOR)
+        height, width = first.shape[:2]
+        duration = frames[-1][0] - frames[0][0]
+        fps = (len(frames) - 1) / duration if duration > 0 else self.fps
+        # Временное имя с точкой в начале не попадает в список записей архива
+        temp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path))
+        # H.264 в MP4: архив проигрывает клипы в <video>, а Chromium не декодирует mp4v.
+        # Кадры уже в JPEG — ffmpeg получает их как есть, без декодирования здесь
+        command = [self.ffmpeg_path, '-nostdin', '-loglevel', 'error', '-y',
+                   '-f', 'image2pipe', '-c:v', 'mjpeg', '-framerate', f'{fps:.3f}', '-i', '-',
+                   '-vf', f'scale={width}:{height}', '-c:v', 'libx264', '-preset', 'veryfast',
+                   '-pix_fmt', 'yuv420p', '-movflags', '+faststart', temp_path]
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE)
+            _, error = process.communicate(b''.join(data for _, data in frames))
+            if process.returncode != 0:
+                raise IOError(error.decode('utf-8', 'replace').strip() or f"ffmpeg exited with code {process.returncode}")
+            os.replace(temp_path, path)
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            on_done({"status": "error", "message": f"Pre-roll clip failed: {e}"})
+            return
+        on_done({"status": "preroll_saved", "path": path, "start": frames[0][0],
+                 "duration": round(duration, 2), "frames": len(frames)})
+
+class SnapshotWriter:
+    """Encodes event snapshots (the frame plus per-object crops) off the analysis thread.
+
+    submit() only copies the frame and queues it; a few daemon threads encode JPEG or
+    WebP (cv2.imencode releases the GIL) and write the files atomically. A full queue
+    drops the snapshot instead of waiting, and the directory is trimmed to max_bytes,
+    oldest files first, so neither inference latency nor disk usage grows under load.
+    """
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, image_format='jpg', quality=80,
+                 width=1280, crop_padding=0.1, workers=2, queue_size=8):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        webp = image_format == 'webp'
+        self.extension = '.webp' if webp else '.jpg'
+        self.params = [cv2.IMWRITE_WEBP_QUALITY if webp else cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        self.width = int(width)
+        self.crop_padding = float(crop_padding)
+        self.queue = queue.Queue(maxsize=int(queue_size))
+        self.lock = threading.Lock()
+        self.files = collections.deque()  # (путь, размер) от старых к новым
+        self.bytes = 0
+        self.sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        self.scan()
+        for _ in range(max(1, int(workers))):
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def scan(self):
+        # Снимки прошлых запусков тоже учитываются в лимите
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self.files.append((path, size))
+            self.bytes += size
+
+    def submit(self, frame, boxes, prefix):
+        """Queues the frame and crops of boxes [(x, y, w, h)]; returns (frame path, crop paths) or None if dropped."""
+        if self.queue.full():
+            return None
+        with self.lock:
+            self.sequence += 1
+            stem = f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{self.sequence}"
+        frame_path = os.path.join(self.directory, stem + self.extension)
+        crop_paths = [os.path.join(self.directory, f"{stem}-{i}{self.extension}") for i in range(len(boxes))]
+        # Копия обязательна: FfmpegFrameGrabber переиспользует буферы кадров
+        try:
+            self.queue.put_nowait((frame.copy(), boxes, frame_path, crop_paths))
+        except queue.Full:
+            return None
+        return frame_path, crop_paths
+
+    def work(self):
+        while True:
+            frame, boxes, frame_path, crop_paths = self.queue.get()
+            try:
+                height, width = frame.shape[:2]
+                for (x, y, w, h), path in zip(boxes, crop_paths):
+                    pad_x, pad_y = int(w * self.crop_padding), int(h * self.crop_padding)
+                    crop = frame[max(0, y - pad_y):min(height, y + h + pad_y), max(0, x - pad_x):min(width, x + w + pad_x)]
+                    if crop.size:
+                        self.write(path, crop)
+                if width > self.width:
+                    frame = cv2.resize(frame, (self.width, int(height * self.width / width)), interpolation=cv2.INTER_AREA)
+                self.write(frame_path, frame)
+            except Exception as e:
+                emit({"status": "error", "message": f"Snapshot failed: {e}"})
+
+    def write(self, path, image):
+        ok, data = cv2.imencode(self.extension, image, self.params)
+        if not ok:
+            raise IOError(f"Cannot encode {path}")
+        # Временное имя с точкой: читатель события не увидит недописанный файл
+        temp_path = os.path.join(self.directory, '.' + os.path.basename(path))
+        with open(temp_path, 'wb') as f:
+            f.write(data.tobytes())
+        os.replace(temp_path, path)
+        with self.lock:
+            self.files.append((path, len(data)))
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes and len(self.files) > 1:
+                old_path, size = self.files.popleft()
+                self.bytes -= size
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+_snapshot_writers = {}
+_snapshot_writers_lock = threading.Lock()
+
+def get_snapshot_writer(config):
+    """One SnapshotWriter (and worker pool) per snapshot_dir, shared by the cameras of a process."""
+    directory = config.get('snapshot_dir')
+    if not directory:
+        return None
+    with _snapshot_writers_lock:
+        writer = _snapshot_writers.get(directory)
+        if writer is None:
+            writer = _snapshot_writers[directory] = SnapshotWriter(
+                directory, max_bytes=float(config.get('snapshot_max_mb', 256)) * 1024 * 1024,
+                image_format=config.get('snapshot_format', 'jpg'), quality=config.get('snapshot_quality', 80),
+                width=config.get('snapshot_width', 1280), workers=config.get('snapshot_workers', 2),
+                queue_size=config.get('snapshot_queue_size', 8))
+        return writer
+
+class DetectionStore:
+    """Append-only detection log: one JSONL segment per UTC date and camera plus a sidecar index.
+
+    append() only queues the event; a background thread writes the queue in batches
+    every flush_interval (sooner when max_pending pile up), so no file is ever reread or
+    rewritten on the detection path. The sidecar <camera>.idx.json keeps per-label
+    counts, the first/last timestamps and the byte offset of the first event of every
+    minute, which lets readers skip segments without a wanted label and seek straight
+    to a time range. `bytes` is the segment size the index covers; a mismatch after a
+    crash makes the index be rebuilt from the segment.
+    """
+    INDEX_VERSION = 1
+
+    def __init__(self, directory, flush_interval=1.0, max_pending=256):
+        self.directory = directory
+        self.flush_interval = float(flush_interval)
+        self.max_pending = int(max_pending)
+        self.pending = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.indexes = {}  # путь сегмента -> индекс
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+
+    def append(self, camera_id, event):
+        with self.lock:
+            self.pending.append((camera_id, event))
+            if len(self.pending) >= self.max_pending:
+                self.wakeup.set()
+
+    def flush_loop(self):
+        while not self.stopped:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            segments = {}
+            for camera_id, event in pending:
+                date = time.strftime('%Y-%m-%d', time.gmtime(event['t']))
+                segments.setdefault((date, camera_id), []).append(event)
+            for (date, camera_id), events in segments.items():
+                try:
+                    self.write_segment(date, camera_id, events)
+                except OSError as e:
+                    emit({"status": "error", "message": f"Cannot store detections: {e}"})
+
+    def write_segment(self, date, camera_id, events):
+        directory = os.path.join(self.directory, date)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{camera_id}.jsonl')
+        index = self.load_index(path)
+        day_start = calendar.timegm(time.strptime(date, '%Y-%m-%d'))
+        start = index['bytes']
+        lines = bytearray()
+        if index.pop('needs_newline', False):
+            lines += b'\n'  # недописанная после сбоя строка не склеится с новой
+        for event in events:
+            self.add_to_index(index, event, start + len(lines), day_start)
+            lines += (json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')
+        with open(path, 'ab') as f:
+            f.write(lines)
+        index['bytes'] = start + len(lines)
+        self.save_index(path, index)
+
+    @staticmethod
+    def add_to_index(index, event, offset, day_start):
+        minute = int((event['t'] - day_start) // 60)
+        if not index['minutes'] or minute > index['minutes'][-1][0]:
+            index['minutes'].append([minute, offset])
+        for label in event['labels']:
+            index['labels'][label] = index['labels'].get(label, 0) + 1
+        index['first'] = event['t'] if index['first'] is None else min(index['first'], event['t'])
+        index['last'] = event['t'] if index['last'] is None else max(index['last'], event['t'])
+        index['count'] += 1
+
+    def load_index(self, path):
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        index = self.indexes.get(path)
+        # Сегмент мог дописать другой процесс (камера переехала на другой воркер супервизора)
+        if index is not None and index['bytes'] == size:
+            return index
+        try:
+            with open(path[:-len('.jsonl')] + '.idx.json', 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+        if index is None or index.get('version') != self.INDEX_VERSION or index.get('bytes') != size:
+            index = self.rebuild_index(path, size)
+        self.indexes[path] = index
+        return index
+
+    def rebuild_index(self, path, size):
+        index = {"version": self.INDEX_VERSION, "bytes": size, "count": 0, "first": None, "last": None,
+                 "labels": {}, "minutes": []}
+        if not size:
+            return index
+        date = os.path.basename(os.path.dirname(path))
+        day_start = calendar.timegm(time.strptime(date, '%Y-%m-%d'))
+        offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    self.add_to_index(index, json.loads(line), offset, day_start)
+                except ValueError:
+                    pass  # строка, оборванная сбоем
+                offset += len(line)
+                index['needs_newline'] = not line.endswith(b'\n')
+        return index
+
+    def save_index(self, path, index):
+        index_path = path[:-len('.jsonl')] + '.idx.json'
+        temp_path = index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(temp_path, index_path)
+
+    def close(self):
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join(timeout=2.0)
+        self.flush()
+
+_detection_stores = {}
+_detection_stores_lock = threading.Lock()
+
+def get_detection_store(config):
+    """One DetectionStore per events_dir, shared by the cameras of a process."""
+    directory = config.get('events_dir')
+    if not directory:
+        return None
+    with _detection_stores_lock:
+        store = _detection_stores.get(directory)
+        if store is None:
+            store = _detection_stores[directory] = DetectionStore(
+                directory, flush_interval=config.get('events_flush_interval', 1.0))
+        return store
+
+def close_detection_stores():
+    for store in _detection_stores.values():
+        store.close()
+
+class FrameScheduler:
+    """Picks frames for analysis to hold a target analytics FPS per camera.
+
+    The sampling interval is the larger of 1/target_fps and the rolling inference
+    latency, so a slow provider lowers the rate instead of building a backlog. Without
+    target_fps the rate follows the measured source FPS divided by frame_skip.
+    Frames older than max_frame_age are dropped as stale.
+    """
+    def __init__(self, target_fps=None, frame_skip=5, max_frame_age=1.0, smoothing=0.2):
+        self.target_fps = float(target_fps) if target_fps else None
+        self.frame_skip = max(1, int(frame_skip))
+        self.max_frame_age = float(max_frame_age)
+        self.smoothing = smoothing
+        self.source_interval = None
+        self.latency = 0.0
+        self.last_frame_ts = None
+        self.last_sample_ts = None
+        self.dropped_stale = 0
+        self.processed = 0
+        self.window_start = time.monotonic()
+        self.window_processed = 0
+
+    def ema(self, current, value):
+        return value if current is None else current + self.smoothing * (value - current)
+
+    @property
+    def interval(self):
+        if self.target_fps:
+            target = 1.0 / self.target_fps
+        else:
+            target = (self.source_interval or 0.0) * self.frame_skip
+        return max(target, self.latency)
+
+    def should_process(self, timestamp):
+        if self.last_frame_ts is not None and timestamp > self.last_frame_ts:
+            self.source_interval = self.ema(self.source_interval, timestamp - self.last_frame_ts)
+        self.last_frame_ts = timestamp
+
+        if time.monotonic() - timestamp > self.max_frame_age:
+            self.dropped_stale += 1
+            return False
+        if self.last_sample_ts is not None:
+            # Допуск в полкадра, чтобы не проскакивать нужный кадр из-за джиттера
+            tolerance = (self.source_interval or 0.0) / 2
+            if timestamp - self.last_sample_ts < self.interval - tolerance:
+                return False
+        self.last_sample_ts = timestamp
+        return True
+
+    def missed(self, count, timestamp):
+        """Estimates how many of the count frames overwritten before timestamp would have
+        been sampled; the rest would have been skipped by the schedule anyway."""
+        if self.last_sample_ts is None or not self.source_interval:
+            return count
+        step = self.source_interval
+        # Первый кадр пропуска, который расписание взяло бы, и последний кадр пропуска
+        due = self.last_sample_ts + self.interval - step / 2
+        last_missed = timestamp - step
+        if due > last_missed:
+            return 0
+        return min(count, 1 + int((last_missed - due) // max(self.interval, step)))
+
+    def record_latency(self, seconds):
+        self.latency = self.ema(self.latency if self.processed else None, seconds)
+        self.processed += 1
+        self.window_processed += 1
+
+    def stats(self):
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        effective_fps = self.window_processed / elapsed if elapsed > 0 else 0.0
+        self.window_start, self.window_processed = now, 0
+        return {
+            "effective_fps": round(effective_fps, 2),
+            "inference_latency_ms": round(self.latency * 1000, 1),
+            "sampling_interval_ms": round(self.interval * 1000, 1),
+            "dropped_stale": self.dropped_stale,
+        }
+
+class PipelineMetrics:
+    """Per-stage timers and frame counters of one camera, reported and reset every interval.
+
+    Stage timings keep the last max_samples values, enough for p50/p95 at analytics
+    frame rates; counters are plain integers, so recording costs two perf_counter calls.
+    """
+    # grab — чтение и декод кадра в потоке захвата, включая ожидание камеры;
+    # wait — простой цикла анализа в ожидании нового кадра
+    STAGES = ('grab', 'wait', 'motion', 'preprocess', 'inference', 'postprocess', 'emit', 'snapshot')
+    COUNTERS = ('frames_grabbed', 'frames_dropped', 'frames_analyzed', 'frames_skipped',
+                'motion_passed', 'motion_skipped', 'reconnects', 'snapshots_dropped')
+
+    def __init__(self, max_samples=1024):
+        self.max_samples = max_samples
+        self.reset()
+
+    def reset(self):
+        self.samples = {stage: collections.deque(maxlen=self.max_samples) for stage in self.STAGES}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.window_start = time.monotonic()
+
+    def record(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    def count(self, counter, value=1):
+        self.counters[counter] += value
+
+    def snapshot(self):
+        """Returns the metrics of the window since the previous call and starts a new one."""
+        stages = {}
+        for stage, values in self.samples.items():
+            if not values:
+                continue
+            ms = np.fromiter(values, dtype=np.float64, count=len(values)) * 1000.0
+            stages[stage] = {
+                "count": len(ms),
+                "mean_ms": round(float(ms.mean()), 2),
+                "p50_ms": round(float(np.percentile(ms, 50)), 2),
+                "p95_ms": round(float(np.percentile(ms, 95)), 2),
+                "max_ms": round(float(ms.max()), 2),
+            }
+        metrics = {"window_s": round(time.monotonic() - self.window_start, 1),
+                   "counters": self.counters, "stages": stages}
+        self.reset()
+        return metrics
+
+class SamplingProfiler:
+    """Samples the stack of one thread at a fixed interval and counts the innermost functions.
+
+    Unlike cProfile it does not slow the profiled thread down, so it is safe to keep on
+    a live camera; the price is statistical rather than exact numbers.
+    """
+    def __init__(self, thread_id, interval=0.01):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.total = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            code = frame.f_code
+            self.counts[f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"] += 1
+            self.total += 1
+
+    def report(self, limit=15):
+        counts, total = self.counts, self.total
+        self.counts, self.total = collections.Counter(), 0
+        return [{"function": name, "share": round(n / total, 3)} for name, n in counts.most_common(limit)]
+
+    def stop(self):
+        self.stopped.set()
+
+class CProfileHook:
+    """Deterministic profile of the calling thread via cProfile, cumulative since start."""
+    def __init__(self, output_path=None):
+        self.profile = cProfile.Profile()
+        self.output_path = output_path
+
+    def start(self):
+        self.profile.enable()
+
+    def report(self, limit=15):
+        self.profile.disable()
+        stats = pstats.Stats(self.profile)
+        entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        if self.output_path:
+            stats.dump_stats(self.output_path)
+        self.profile.enable()
+        return [{"function": f"{os.path.basename(filename)}:{name}:{line}", "calls": nc,
+                 "tottime_ms": round(tt * 1000, 1), "cumtime_ms": round(ct * 1000, 1)}
+                for (filename, line, name), (cc, nc, tt, ct, callers) in entries]
+
+    def stop(self):
+        self.profile.disable()
+        if self.output_path:
+            self.profile.dump_stats(self.output_path)
+
+def create_profiler(config):
+    """Profiler for the current thread from config['profiler']: 'cprofile', 'sampling' or none."""
+    kind = config.get('profiler')
+    if kind == 'cprofile':
+        return CProfileHook(config.get('profile_path'))
+    if kind == 'sampling':
+        return SamplingProfiler(threading.get_ident(), float(config.get('profile_interval_ms', 10)) / 1000.0)
+    return None
 
 def preprocess(img, input_width, input_height):
     img_height, img_width = img.shape[:2]
@@ -77,132 +756,1807 @@ def preprocess(img, input_width, input_height):
     image_data = np.expand_dims(image_data, axis=0)
     return image_data, ratio, ((input_width - new_width) // 2, (input_height - new_height) // 2)
 
+class Preprocessor:
+    """Letterbox preprocessing into preallocated buffers for one (source size, model size) pair.
+
+    Resize ratio and padding are computed once; every call writes into the same uint8
+    canvas and float32 NCHW tensor, so no per-frame allocations happen. The returned
+    tensor is reused by the next call; `out` lets it be a slice of a batch buffer.
+    """
+    def __init__(self, img_width, img_height, input_width, input_height, out=None):
+        self.ratio = min(input_width / img_width, input_height / img_height)
+        self.new_width, self.new_height = int(img_width * self.ratio), int(img_height * self.ratio)
+        self.pad = ((input_width - self.new_width) // 2, (input_height - self.new_height) // 2)
+        self.needs_resize = (self.new_width, self.new_height) != (img_width, img_height)
+        self.canvas = np.full((input_height, input_width, 3), 114, dtype=np.uint8)
+        self.canvas_roi = self.canvas[self.pad[1]:self.pad[1] + self.new_height,
+                                      self.pad[0]:self.pad[0] + self.new_width]
+        self.resized = np.empty((self.new_height, self.new_width, 3), dtype=np.uint8)
+        self.tensor = out if out is not None else np.empty((1, 3, input_height, input_width), dtype=np.float32)
+        self.planes = np.empty((3, input_height, input_width), dtype=np.uint8)
+        self.scale = np.float32(1.0 / 255.0)
+
+    def __call__(self, img):
+        if self.needs_resize:
+            cv2.resize(img, (self.new_width, self.new_height), dst=self.resized, interpolation=cv2.INTER_LINEAR)
+            np.copyto(self.canvas_roi, self.resized)
+        else:
+            np.copyto(self.canvas_roi, img)
+        # HWC -> CHW через extractChannel (быстрее, чем чтение транспонированного вида),
+        # затем uint8 -> float32 [0, 1] прямо в выходной буфер
+        for channel in range(3):
+            cv2.extractChannel(self.canvas, channel, dst=self.planes[channel])
+        np.multiply(self.planes, self.scale, out=self.tensor[0], casting='unsafe')
+        return self.tensor, self.ratio, self.pad
+
+class PreprocessorCacheMixin:
+    """Keeps one Preprocessor per (frame size, model input size) in self.preprocessors.
+
+    The host class sets self.preprocessors = {} and self.input_width/input_height.
+    """
+    def get_preprocessor(self, frame):
+        img_height, img_width = frame.shape[:2]
+        key = (img_width, img_height, self.input_width, self.input_height)
+        preprocessor = self.preprocessors.get(key)
+        if preprocessor is None:
+            preprocessor = self.preprocessors[key] = Preprocessor(*key)
+        return preprocessor
+
+def run_inference(session, input_name, output_name, tensor):
+    # IO binding отдаёт numpy-буфер в ORT без промежуточной копии
+    binding = session.io_binding()
+    binding.bind_cpu_input(input_name, tensor)
+    binding.bind_output(output_name)
+    session.run_with_iobinding(binding)
+    return binding.copy_outputs_to_cpu()[0]
+
+COCO_LABELS = [COCO_CLASSES[i] for i in range(len(COCO_CLASSES))]
+LABEL_TO_CLASS_ID = {label: class_id for class_id, label in COCO_CLASSES.items()}
+
+DETECTION_DTYPE = np.dtype([
+    ('class_id', np.int32), ('confidence', np.float32),
+    ('x1', np.float32), ('y1', np.float32), ('x2', np.float32), ('y2', np.float32),
+])
+
+def nms(boxes, scores, iou_threshold):
+    # Жадный NMS на numpy; boxes — (N, 4) в формате x1, y1, x2, y2
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        inter_w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        inter_h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = inter_w * inter_h
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.intp)
+
+def batched_nms(boxes, scores, class_ids, iou_threshold):
+    # Сдвигаем рамки каждого класса в свою область, чтобы разные классы не подавляли друг друга
+    offsets = class_ids.astype(np.float32)[:, None] * (float(boxes.max()) + 1.0)
+    return nms(boxes + offsets, scores, iou_threshold)
+
+class Postprocessor:
+    """Vectorized YOLOv8 decoding with the configured label filter applied up front.
+
+    The `objects` list is turned into a class-id mask once; unwanted classes are dropped
+    before thresholding and NMS. Returns a DETECTION_DTYPE structured array in source
+    frame coordinates; use detections_to_objects() only when an event is emitted.
+    """
+    def __init__(self, objects=None, confidence_threshold=0.5, iou_threshold=0.5):
+        self.confidence_threshold = confidence_threshold
+        self.iou_threshold = iou_threshold
+        if objects:
+            self.class_ids = np.array(sorted({LABEL_TO_CLASS_ID[o] for o in objects if o in LABEL_TO_CLASS_ID}), dtype=np.intp)
+        else:
+            self.class_ids = None
+
+    def __call__(self, output, ratio, pad, offset=(0, 0)):
+        predictions = output.reshape(output.shape[-2], output.shape[-1])  # (4 + классы, якоря)
+        if self.class_ids is None:
+            class_scores = predictions[4:]
+        elif self.class_ids.size == 0:
+            return np.empty(0, dtype=DETECTION_DTYPE)
+        else:
+            class_scores = predictions[4 + self.class_ids]
+
+        best = class_scores.argmax(axis=0)
+        scores = np.take_along_axis(class_scores, best[None, :], axis=0)[0]
+        candidates = np.flatnonzero(scores > self.confidence_threshold)
+        if candidates.size == 0:
+            return np.empty(0, dtype=DETECTION_DTYPE)
+
+        scores = scores[candidates]
+        class_ids = best[candidates] if self.class_ids is None else self.class_ids[best[candidates]]
+        cx, cy, w, h = predictions[:4, candidates]
+        boxes = np.empty((candidates.size, 4), dtype=np.float32)
+        # offset — положение кропа зоны в кадре (см. ZoneCropper)
+        boxes[:, 0] = (cx - w / 2 - pad[0]) / ratio + offset[0]
+        boxes[:, 1] = (cy - h / 2 - pad[1]) / ratio + offset[1]
+        boxes[:, 2] = (cx + w / 2 - pad[0]) / ratio + offset[0]
+        boxes[:, 3] = (cy + h / 2 - pad[1]) / ratio + offset[1]
+
+        keep = batched_nms(boxes, scores, class_ids, self.iou_threshold)
+        detections = np.empty(keep.size, dtype=DETECTION_DTYPE)
+        detections['class_id'] = class_ids[keep]
+        detections['confidence'] = scores[keep]
+        detections['x1'], detections['y1'], detections['x2'], detections['y2'] = boxes[keep].T
+        return detections
+
+def detections_to_objects(detections):
+    return [{
+        'label': COCO_LABELS[class_id],
+        'confidence': confidence,
+        'box': {'x': int(x1), 'y': int(y1), 'w': int(x2 - x1), 'h': int(y2 - y1)}
+    } for class_id, confidence, x1, y1, x2, y2 in detections.tolist()]
+
 def postprocess(output, ratio, pad, confidence_threshold=0.5, iou_threshold=0.5):
-    predictions = np.squeeze(output).T
-    scores = np.max(predictions[:, 4:], axis=1)
-    predictions = predictions[scores > confidence_threshold, :]
-    scores = scores[scores > confidence_threshold]
-    if predictions.shape[0] == 0:
+    return detections_to_objects(Postprocessor(None, confidence_threshold, iou_threshold)(output, ratio, pad))
+
+def parse_regions(regions):
+    """Normalizes ROI/zone definitions to a list of (N, 2) float32 polygons in 0..1 frame coordinates.
+
+    Accepts a single region or a list of them; a region is either a rectangle
+    {"x", "y", "w", "h"} or a polygon given as [[x, y], ...] or {"points": [[x, y], ...]}.
+    """
+    if not regions:
         return []
-    class_ids = np.argmax(predictions[:, 4:], axis=1)
-    boxes = predictions[:, :4]
-    x, y, w, h = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
-    x1, y1, x2, y2 = x - w / 2, y - h / 2, x + w / 2, y + h / 2
-    x1, y1, x2, y2 = (x1 - pad[0]) / ratio, (y1 - pad[1]) / ratio, (x2 - pad[0]) / ratio, (y2 - pad[1]) / ratio
-    indices = cv2.dnn.NMSBoxes(np.column_stack((x1, y1, x2 - x1, y2 - y1)), scores, confidence_threshold, iou_threshold)
-    detections = []
-    for i in indices:
-        detections.append({
-            'label': COCO_CLASSES[class_ids[i]],
-            'confidence': float(scores[i]),
-            'box': {'x': int(x1[i]), 'y': int(y1[i]), 'w': int(x2[i] - x1[i]), 'h': int(y2[i] - y1[i])}
-        })
-    return detections
+    if isinstance(regions, dict) or (isinstance(regions[0], (list, tuple)) and isinstance(regions[0][0], (int, float))):
+        regions = [regions]
+    polygons = []
+    for region in regions:
+        if isinstance(region, dict) and 'points' not in region:
+            x, y, w, h = (float(region[k]) for k in ('x', 'y', 'w', 'h'))
+            points = [[x, y], [x + w, y], [x + w, y + h], [x, y + h]]
+        else:
+            points = region['points'] if isinstance(region, dict) else region
+        polygon = np.clip(np.asarray(points, dtype=np.float32).reshape(-1, 2), 0.0, 1.0)
+        if polygon.shape[0] >= 3:
+            polygons.append(polygon)
+    return polygons
+
+def regions_mask(polygons, width, height):
+    mask = np.zeros((height, width), dtype=np.uint8)
+    scale = np.array([width, height], dtype=np.float32)
+    cv2.fillPoly(mask, [np.round(p * scale).astype(np.int32) for p in polygons], 255)
+    return mask
+
+class ZoneCropper:
+    """Runs the model on crops around the configured zones instead of the whole frame.
+
+    The bounding box of every zone, grown by `margin` and merged with the boxes it
+    overlaps, becomes one crop letterboxed straight into a shared (N,3,H,W) batch, so a
+    doorway on a 4MP camera reaches the model at full resolution. Detections are mapped
+    back by Postprocessor(offset=...) and kept only if their center lies inside a zone.
+    Use create() — it returns None when no zone has an area, so the caller infers
+    on the whole frame.
+    """
+    def __init__(self, zones, input_width, input_height, margin=0.1):
+        # Полигоны меньше чем из трёх точек отбрасывает parse_regions, вырожденные — здесь
+        self.polygons = [p for p in parse_regions(zones) if cv2.contourArea(p) > 0]
+        self.input_width, self.input_height = input_width, input_height
+        self.margin = float(margin)
+        self.frame_size = None
+        self.pixel_polygons = []
+        self.rects = []
+
+    @classmethod
+    def create(cls, zones, input_width, input_height, margin=0.1):
+        cropper = cls(zones, input_width, input_height, margin) if zones else None
+        return cropper if cropper is not None and cropper.polygons else None
+
+    def configure(self, width, height):
+        scale = np.array([width, height], dtype=np.float32)
+        self.pixel_polygons = [np.round(p * scale).astype(np.int32) for p in self.polygons]
+        rects = []
+        for polygon in self.pixel_polygons:
+            x, y, w, h = cv2.boundingRect(polygon)
+            grow_x, grow_y = int(w * self.margin), int(h * self.margin)
+            rect = [max(0, x - grow_x), max(0, y - grow_y), min(width, x + w + grow_x), min(height, y + h + grow_y)]
+            if rect[2] - rect[0] >= 2 and rect[3] - rect[1] >= 2:
+                rects.append(rect)
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    a, b = rects[i], rects[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del rects[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        self.rects = rects
+        self.batch = np.empty((len(rects), 3, self.input_height, self.input_width), dtype=np.float32)
+        self.preprocessors = [Preprocessor(x1 - x0, y1 - y0, self.input_width, self.input_height,
+                                           out=self.batch[i:i + 1])
+                              for i, (x0, y0, x1, y1) in enumerate(rects)]
+        self.frame_size = (width, height)
+
+    def crops(self, frame):
+        """Fills the batch with all crops; returns (batch, [(ratio, pad, offset), ...])."""
+        height, width = frame.shape[:2]
+        if self.frame_size != (width, height):
+            self.configure(width, height)
+        params = []
+        for (x0, y0, x1, y1), preprocessor in zip(self.rects, self.preprocessors):
+            _, ratio, pad = preprocessor(frame[y0:y1, x0:x1])
+            params.append((ratio, pad, (x0, y0)))
+        return self.batch, params
+
+    def filter(self, detections):
+        if detections.size == 0:
+            return detections
+        centers_x = (detections['x1'] + detections['x2']) / 2
+        centers_y = (detections['y1'] + detections['y2']) / 2
+        inside = np.array([any(cv2.pointPolygonTest(polygon, (float(cx), float(cy)), False) >= 0
+                               for polygon in self.pixel_polygons)
+                           for cx, cy in zip(centers_x, centers_y)], dtype=bool)
+        return detections[inside]
+
+class MotionGate:
+    """Cheap frame-difference pre-filter in front of YOLO.
+
+    Keeps a running-average grayscale background of a downscaled frame and reports
+    motion when the share of changed pixels (inside the ROI, if one is set) reaches
+    `threshold`. Inference is also let through every `keepalive` seconds.
+    """
+    def __init__(self, threshold=0.01, keepalive=30.0, roi=None, width=160, pixel_threshold=25, learning_rate=0.05):
+        self.threshold = float(threshold)
+        self.keepalive = float(keepalive)
+        self.polygons = parse_regions(roi)
+        self.width = int(width)
+        self.pixel_threshold = pixel_threshold
+        self.learning_rate = learning_rate
+        self.source_shape = None
+        self.last_pass = 0.0
+
+    def reset(self, frame):
+        img_height, img_width = frame.shape[:2]
+        height = max(1, round(img_height * self.width / img_width))
+        self.source_shape = frame.shape
+        self.small = np.empty((height, self.width, 3), dtype=np.uint8)
+        self.gray = np.empty((height, self.width), dtype=np.uint8)
+        self.background_u8 = np.empty_like(self.gray)
+        self.diff = np.empty_like(self.gray)
+        self.roi_mask = regions_mask(self.polygons, self.width, height) if self.polygons else None
+        self.area = cv2.countNonZero(self.roi_mask) if self.roi_mask is not None else self.gray.size
+        self.background = None
+
+    def check(self, frame):
+        if frame.shape != self.source_shape:
+            self.reset(frame)
+        cv2.resize(frame, (self.width, self.gray.shape[0]), dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+        now = time.monotonic()
+        if self.background is None:
+            self.background = self.gray.astype(np.float32)
+            motion = True
+        else:
+            cv2.convertScaleAbs(self.background, dst=self.background_u8)
+            cv2.absdiff(self.gray, self.background_u8, dst=self.diff)
+            cv2.threshold(self.diff, self.pixel_threshold, 255, cv2.THRESH_BINARY, dst=self.diff)
+            if self.roi_mask is not None:
+                cv2.bitwise_and(self.diff, self.roi_mask, dst=self.diff)
+            motion = self.area > 0 and cv2.countNonZero(self.diff) / self.area >= self.threshold
+            cv2.accumulateWeighted(self.gray, self.background, self.learning_rate)
+
+        if motion or now - self.last_pass >= self.keepalive:
+            self.last_pass = now
+            return True
+        return False
+
+def box_iou(boxes_a, boxes_b):
+    # Попарный IoU: (A, 4) x (B, 4) -> (A, B)
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+class Track:
+    __slots__ = ('track_id', 'class_id', 'confidence', 'box', 'first_seen', 'last_seen', 'last_reported')
+
+    def __init__(self, track_id, class_id, confidence, box, now):
+        self.track_id = track_id
+        self.class_id = class_id
+        self.confidence = confidence
+        self.box = box
+        self.first_seen = self.last_seen = self.last_reported = now
+
+    def to_object(self, event):
+        x1, y1, x2, y2 = self.box.tolist()
+        return {
+            'track_id': self.track_id,
+            'event': event,
+            'label': COCO_LABELS[self.class_id],
+            'confidence': self.confidence,
+            'box': {'x': int(x1), 'y': int(y1), 'w': int(x2 - x1), 'h': int(y2 - y1)},
+        }
+
+class Tracker:
+    """Greedy IoU/centroid tracker that turns per-frame detections into track lifecycle events.
+
+    A detection continues a track of the same class when their IoU reaches iou_threshold
+    or, failing that, when its centre is within max_centroid_shift box diagonals of the
+    track (analysis often runs at a few FPS). update() returns (event, track) pairs:
+    'appeared' for new tracks, 'updated' at most every update_interval seconds per
+    track and 'disappeared' once a track has gone unmatched for max_age seconds.
+    """
+    def __init__(self, iou_threshold=0.3, max_centroid_shift=0.5, max_age=5.0, update_interval=10.0):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_shift = max_centroid_shift
+        self.max_age = max_age
+        self.update_interval = update_interval
+        self.tracks = []
+        self.next_id = 1
+
+    def match_scores(self, track_boxes, track_classes, boxes, class_ids):
+        scores = box_iou(track_boxes, boxes)
+        track_centers = (track_boxes[:, :2] + track_boxes[:, 2:]) / 2
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        diagonals = np.hypot(track_boxes[:, 2] - track_boxes[:, 0], track_boxes[:, 3] - track_boxes[:, 1])
+        shift = np.linalg.norm(track_centers[:, None, :] - centers[None, :, :], axis=2) / np.maximum(diagonals[:, None], 1e-9)
+        # Совпадение по центру засчитываем чуть ниже порога IoU, чтобы IoU-пары имели приоритет
+        by_centroid = (scores < self.iou_threshold) & (shift <= self.max_centroid_shift)
+        scores = np.where(by_centroid, self.iou_threshold * (1.0 - shift / (2 * self.max_centroid_shift)), scores)
+        scores[track_classes[:, None] != class_ids[None, :]] = 0.0
+        return scores
+
+    def update(self, detections, now=None):
+        now = time.monotonic() if now is None else now
+        boxes = np.stack([detections['x1'], detections['y1'], detections['x2'], detections['y2']], axis=1)
+        class_ids = detections['class_id']
+        matched_tracks, matched_detections = set(), set()
+        events = []
+
+        if self.tracks and detections.size:
+            track_boxes = np.stack([t.box for t in self.tracks])
+            track_classes = np.array([t.class_id for t in self.tracks])
+            scores = self.match_scores(track_boxes, track_classes, boxes, class_ids)
+            min_score = self.iou_threshold / 2
+            for flat_index in np.argsort(-scores, axis=None):
+                t, d = np.unravel_index(flat_index, scores.shape)
+                if scores[t, d] < min_score:
+                    break
+                if t in matched_tracks or d in matched_detections:
+                    continue
+                matched_tracks.add(t)
+                matched_detections.add(d)
+                track = self.tracks[t]
+                track.box, track.confidence, track.last_seen = boxes[d], float(detections['confidence'][d]), now
+                if now - track.last_reported >= self.update_interval:
+                    track.last_reported = now
+                    events.append(('updated', track))
+
+        alive = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks and now - track.last_seen > self.max_age:
+                events.append(('disappeared', track))
+            else:
+                alive.append(track)
+        for d in range(detections.size):
+            if d not in matched_detections:
+                track = Track(self.next_id, int(class_ids[d]), float(detections['confidence'][d]), boxes[d], now)
+                self.next_id += 1
+                alive.append(track)
+                events.append(('appeared', track))
+        self.tracks = alive
+        return events
+
 # --- Конец хелперов ---
 
-def run_analytics(rtsp_url, config_str, provider_choice='auto'):
+# --- Каналы вывода: построчный JSON (по умолчанию) или бинарные кадры ---
+
+class JsonChannel:
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def send(self, payload):
+        with self.lock:
+            print(json.dumps(payload), file=self.stream or sys.stdout, flush=True)
+
+    def close(self):
+        pass
+
+class QueueChannel:
+    """Hands messages to the parent process (see analyze_files) instead of writing them."""
+    def __init__(self, queue):
+        self.queue = queue
+
+    def send(self, payload):
+        self.queue.put(payload)
+
+    def close(self):
+        pass
+
+class BinaryChannel:
+    """Length-prefixed binary frames with batched flushes.
+
+    Every frame is <uint32 length><uint8 type><payload>, little-endian:
+      FRAME_JSON       UTF-8 JSON of a status message (info, error, stats, ...)
+      FRAME_DETECTIONS DETECTIONS_HEADER followed by `count` DETECTION_RECORDs;
+                       kind 0 is objects_detected, kind 1 is objects_lost,
+                       kind 2 is overlay (live-view boxes while tracking)
+    Detections that carry snapshot paths go out as FRAME_JSON.
+    Class ids index the `labels` list sent in the server's ready message.
+    Frames are buffered and written when flush_bytes are pending or
+    flush_interval_ms has passed.
+    """
+    FRAME_JSON = 1
+    FRAME_DETECTIONS = 2
+    # type, kind, cameraId (-1 — нет), timestamp, ширина и высота кадра, число объектов
+    DETECTIONS_HEADER = struct.Struct('<BBqdHHH')
+    # class_id, событие трека, track_id, confidence, x, y, w, h
+    DETECTION_RECORD = struct.Struct('<BBIfiiii')
+    TRACK_EVENTS = {None: 0, 'appeared': 1, 'updated': 2, 'disappeared': 3}
+    KINDS = {'objects_detected': 0, 'objects_lost': 1, 'overlay': 2}
+
+    def __init__(self, stream, flush_interval_ms=50, flush_bytes=64 * 1024):
+        self.stream = stream
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.flush_bytes = flush_bytes
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def pack(cls, payload):
+        kind = cls.KINDS.get(payload.get('status'))
+        camera_id = payload.get('cameraId', -1)
+        if kind is None or not isinstance(camera_id, int) or 'snapshot' in payload:
+            body = json.dumps(payload).encode('utf-8')
+            return struct.pack('<IB', len(body) + 1, cls.FRAME_JSON) + body
+        objects = payload['objects']
+        frame = payload.get('frame') or {}
+        header = cls.DETECTIONS_HEADER.pack(cls.FRAME_DETECTIONS, kind, camera_id, payload['timestamp'],
+                                            frame.get('w', 0), frame.get('h', 0), len(objects))
+        records = b''.join(cls.DETECTION_RECORD.pack(
+            LABEL_TO_CLASS_ID[o['label']], cls.TRACK_EVENTS.get(o.get('event'), 0), o.get('track_id', 0),
+            o['confidence'], o['box']['x'], o['box']['y'], o['box']['w'], o['box']['h']) for o in objects)
+        return struct.pack('<I', len(header) + len(records)) + header + records
+
+    def send(self, payload):
+        frame = self.pack(payload)
+        with self.lock:
+            self.buffer += frame
+            if len(self.buffer) >= self.flush_bytes or payload.get('status') in ('error', 'ready'):
+                self.flush_locked()
+
+    def flush_locked(self):
+        if self.buffer:
+            self.stream.write(self.buffer)
+            self.stream.flush()
+            self.buffer.clear()
+
+    def flush_loop(self):
+        while not self.stopped.wait(self.flush_interval):
+            with self.lock:
+                self.flush_locked()
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            self.flush_locked()
+
+_channel = JsonChannel()
+
+def emit(payload):
+    _channel.send(payload)
+
+def set_channel(channel):
+    global _channel
+    _channel = channel
+
+def open_ipc_endpoint(ipc_path, mode='wb'):
+    """Connects to the local socket (Unix) or named pipe (Windows) the dashboard listens on.
+
+    An endpoint is one-way: output frames are written to it ('wb'), shared-ingest video
+    is read from it ('rb'). Control commands keep coming over stdin, which avoids
+    concurrent reads and writes on one synchronous Windows pipe handle.
+    """
+    if sys.platform == 'win32':
+        return open(ipc_path, mode, buffering=0)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(ipc_path)
+    # Чтение без буфера, как из stdout ffmpeg; сокет закроется вместе с файлом
+    stream = sock.makefile(mode, buffering=0 if mode == 'rb' else -1)
+    sock.close()
+    return stream
+
+def parse_config(config_str):
+    if not config_str:
+        return {}
     try:
-        model_path = os.path.join(application_path, 'yolov8n.onnx')
-        session = None
-        
-        available_providers = ort.get_available_providers()
-        
-        def try_provider(provider_name):
-            nonlocal session
-            if provider_name in available_providers:
+        config_json = base64.b64decode(config_str).decode('utf-8')
+        return json.loads(config_json)
+    except Exception:
+        return {}
+
+MODEL_NAME = 'yolov8n'
+
+def get_cache_dir(config):
+    # model_cache_dir из конфига; пустая строка или false отключают кэш
+    if 'model_cache_dir' in config:
+        return config['model_cache_dir'] or None
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.environ.get('ANALYTICS_CACHE_DIR') or os.path.join(base, 'openipc-analytics')
+
+def model_hash(model_path):
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def optimized_model_path(cache_dir, model_path, provider_name):
+    # Ключ кэша: содержимое модели, провайдер и версия ORT — оптимизированный граф
+    # может содержать узлы, специфичные для провайдера и версии рантайма
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f'{name}-{model_hash(model_path)}-{provider_name}-ort{ort.__version__}.onnx')
+
+EXECUTION_MODES = {
+    'sequential': 'ORT_SEQUENTIAL',
+    'parallel': 'ORT_PARALLEL',
+}
+
+def make_session_options(threading_config=None):
+    """SessionOptions with the thread pools from the config blob.
+
+    Without limits every process sizes its intra-op pool to all cores, so several
+    analytics processes oversubscribe the CPU. Keys: intra_op_threads,
+    inter_op_threads, execution_mode ('sequential' or 'parallel') and allow_spinning.
+    """
+    options = ort.SessionOptions()
+    config = threading_config or {}
+    if config.get('intra_op_threads'):
+        options.intra_op_num_threads = int(config['intra_op_threads'])
+    if config.get('inter_op_threads'):
+        options.inter_op_num_threads = int(config['inter_op_threads'])
+    if config.get('execution_mode') in EXECUTION_MODES:
+        options.execution_mode = getattr(ort.ExecutionMode, EXECUTION_MODES[config['execution_mode']])
+    if 'allow_spinning' in config:
+        # Активное ожидание потоков ORT ускоряет одиночную сессию, но при разделённых
+        # ядрах лишь сжигает их впустую
+        options.add_session_config_entry('session.intra_op.allow_spinning', '1' if config['allow_spinning'] else '0')
+    return options
+
+def cpu_affinity_supported():
+    """True if apply_cpu_affinity can pin cores here: sched_setaffinity or psutil (Windows)."""
+    if hasattr(os, 'sched_setaffinity'):
+        return True
+    try:
+        import psutil
+    except ImportError:
+        return False
+    # В macOS psutil привязку к ядрам не поддерживает
+    return hasattr(psutil.Process, 'cpu_affinity')
+
+def apply_cpu_affinity(cores):
+    """Pins the process to the given cores; returns the cores actually applied or None."""
+    if not cores or not cpu_affinity_supported():
+        return None
+    cores = sorted({int(core) for core in cores})
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+        return cores
+    import psutil
+    psutil.Process().cpu_affinity(cores)
+    return cores
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def open_session(model_path, providers, cache_dir=None, threading_config=None):
+    """Creates a session, reusing a graph optimized on an earlier start when one is cached.
+
+    Returns (session, cache_state) with cache_state 'hit', 'miss' or 'off'. A cache
+    that cannot be read or written only costs the optimization, never the session.
+    """
+    if not cache_dir:
+        return ort.InferenceSession(model_path, sess_options=make_session_options(threading_config),
+                                    providers=providers), 'off'
+    provider_name = providers[0][0] if isinstance(providers[0], tuple) else providers[0]
+    cached_path = optimized_model_path(cache_dir, model_path, provider_name)
+    if os.path.exists(cached_path):
+        try:
+            return ort.InferenceSession(cached_path, sess_options=make_session_options(threading_config),
+                                        providers=providers), 'hit'
+        except Exception:
+            os.remove(cached_path)
+    # Сохраняется граф после переносимых (EXTENDED) оптимизаций; аппаратно-зависимые
+    # преобразования раскладки дешёвые и выполняются при каждой загрузке
+    options = make_session_options(threading_config)
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    temp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix='.onnx', dir=cache_dir)
+        os.close(fd)
+        options.optimized_model_filepath = temp_path
+    except OSError:
+        temp_path = None
+    session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+    if temp_path is None:
+        return session, 'miss'
+    try:
+        # Переименование атомарно: параллельный старт не прочитает недописанный файл
+        os.replace(temp_path, cached_path)
+    except OSError:
+        os.remove(temp_path)
+        return session, 'miss'
+    # Рабочая сессия — из сохранённого графа, уже с полным набором оптимизаций
+    return ort.InferenceSession(cached_path, sess_options=make_session_options(threading_config),
+                                providers=providers), 'miss'
+
+def warm_up(session, input_size):
+    """Runs one inference on a blank tensor so the first real frame does not pay for allocations."""
+    if has_dynamic_input_size(session):
+        input_width = input_height = input_size
+    else:
+        input_width, input_height = get_model_input_size(session)
+    tensor = np.zeros((1, 3, input_height, input_width), dtype=np.float32)
+    run_inference(session, session.get_inputs()[0].name, session.get_outputs()[0].name, tensor)
+
+# Какую точность модели предпочесть на провайдере: INT8 (QDQ) ускоряет CPU,
+# FP16 — GPU через DirectML/CUDA. Варианты выпускает export_model.py --int8/--fp16.
+PROVIDER_PRECISIONS = {
+    'CPUExecutionProvider': ('int8', 'fp32'),
+    'DmlExecutionProvider': ('fp16', 'fp32'),
+    'CUDAExecutionProvider': ('fp16', 'fp32'),
+}
+
+def select_model_variants(model_path, provider_name, precision='auto'):
+    """Existing model files to try on the provider, best first; FP32 is always the last resort.
+
+    Variants live next to the FP32 model as <name>_int8.onnx / <name>_fp16.onnx.
+    precision overrides the per-provider preference ('fp32', 'fp16', 'int8' or 'auto').
+    """
+    precisions = PROVIDER_PRECISIONS.get(provider_name, ('fp32',)) if precision == 'auto' else (precision, 'fp32')
+    stem, ext = os.path.splitext(model_path)
+    candidates = []
+    for name in precisions:
+        path = model_path if name == 'fp32' else f'{stem}_{name}{ext}'
+        if path not in candidates and os.path.exists(path):
+            candidates.append(path)
+    return candidates or [model_path]
+
+def create_session(provider_choice='auto', model_path=None, cache_dir=None, warmup_size=None, precision='auto',
+                   threading_config=None):
+    if model_path is None:
+        model_path = os.path.join(application_path, f'{MODEL_NAME}.onnx')
+    available_providers = ort.get_available_providers()
+
+    def try_provider(provider_name):
+        if provider_name in available_providers:
+            provider_options = {}
+            if provider_name == 'DmlExecutionProvider':
+                provider_options = {'device_id': '0'}
+            providers = [(provider_name, provider_options)]
+            if provider_name != 'CPUExecutionProvider':
+                providers.append('CPUExecutionProvider')
+            candidates = select_model_variants(model_path, provider_name, precision)
+            for candidate in candidates:
                 try:
-                    provider_options = {}
-                    if provider_name == 'DmlExecutionProvider':
-                        provider_options = {'device_id': '0'}
-                    
-                    session = ort.InferenceSession(model_path, providers=[(provider_name, provider_options), 'CPUExecutionProvider'])
-                    print(json.dumps({"status": "info", "provider": provider_name}), flush=True)
-                    return True
+                    started = time.monotonic()
+                    session, cache_state = open_session(candidate, providers, cache_dir, threading_config)
+                    check_batch_dimension(session)
+                    loaded = time.monotonic()
+                    if warmup_size:
+                        warm_up(session, warmup_size)
+                    ready = time.monotonic()
+                    emit({"status": "info", "provider": provider_name, "model": os.path.basename(candidate),
+                          "optimized_model_cache": cache_state,
+                          "session_ms": round((loaded - started) * 1000),
+                          "warmup_ms": round((ready - loaded) * 1000) if warmup_size else None,
+                          "time_to_ready_ms": round((ready - PROCESS_STARTED) * 1000)})
+                    return session
                 except Exception as e:
-                    print(json.dumps({"status": "info", "provider": provider_name, "error": f"{provider_name} failed: {str(e)}"}), flush=True)
-                    session = None
-            return False
+                    # Квантованный вариант может не поддерживаться провайдером — пробуем следующий
+                    if candidate == candidates[-1]:
+                        emit({"status": "info", "provider": provider_name, "error": f"{provider_name} failed: {str(e)}"})
+        return None
 
-        if provider_choice == 'dml':
-            try_provider('DmlExecutionProvider')
-        elif provider_choice == 'auto':
-            if sys.platform == "win32":
-                if not try_provider('DmlExecutionProvider'):
-                    try_provider('CPUExecutionProvider')
-            else:
-                 try_provider('CPUExecutionProvider')
-        
+    session = None
+    if provider_choice == 'dml':
+        session = try_provider('DmlExecutionProvider')
+    elif provider_choice == 'auto':
+        if sys.platform == "win32":
+            session = try_provider('DmlExecutionProvider')
+        if session is None:
+            session = try_provider('CPUExecutionProvider')
+
+    if session is None:
+        session = try_provider('CPUExecutionProvider')
         if session is None:
-            if not try_provider('CPUExecutionProvider'):
-                 raise RuntimeError("Could not initialize any ONNX Runtime provider.")
-
-        input_name = session.get_inputs()[0].name
-        output_name = session.get_outputs()[0].name
-        input_height = session.get_inputs()[0].shape[2]
-        input_width = session.get_inputs()[0].shape[3]
-            
-        config = {}
-        if config_str:
+            raise RuntimeError("Could not initialize any ONNX Runtime provider.")
+    return session
+
+DEFAULT_INPUT_SIZE = 640
+MODEL_STRIDE = 32
+
+def get_model_input_size(session):
+    # У моделей с динамическими осями вместо чисел в shape строки ('height', 'width')
+    shape = session.get_inputs()[0].shape
+    input_height = shape[2] if isinstance(shape[2], int) else DEFAULT_INPUT_SIZE
+    input_width = shape[3] if isinstance(shape[3], int) else DEFAULT_INPUT_SIZE
+    return input_width, input_height
+
+def has_dynamic_input_size(session):
+    shape = session.get_inputs()[0].shape
+    return not isinstance(shape[2], int) or not isinstance(shape[3], int)
+
+def get_config_input_size(config):
+    # resize_width из настроек приложения, округлённый до шага сетки YOLO
+    size = int(config.get('resize_width') or DEFAULT_INPUT_SIZE)
+    return max(MODEL_STRIDE, int(round(size / MODEL_STRIDE)) * MODEL_STRIDE)
+
+def find_model_path(input_size):
+    # Модель, экспортированная под конкретный размер (yolov8n_416.onnx), имеет приоритет
+    sized_path = os.path.join(application_path, f'{MODEL_NAME}_{input_size}.onnx')
+    if os.path.exists(sized_path):
+        return sized_path
+    return os.path.join(application_path, f'{MODEL_NAME}.onnx')
+
+def has_dynamic_batch(session):
+    # Динамическая ось батча — строка/None или -1; фиксированный N > 1 отсекает check_batch_dimension
+    batch_dim = session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dim, int) or batch_dim < 0
+
+def check_batch_dimension(session):
+    """Rejects models exported with a fixed batch other than 1: every caller may send a single frame."""
+    batch_dim = session.get_inputs()[0].shape[0]
+    if isinstance(batch_dim, int) and batch_dim > 1:
+        raise ValueError(f"model has a fixed batch size of {batch_dim}; export it with batch 1 or a dynamic batch")
+
+# --- Батчинг: кадры нескольких камер прогоняются одним вызовом session.run ---
+
+class InferenceRequest:
+    __slots__ = ('tensor', 'output', 'error', 'done')
+
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.output = None
+        self.error = None
+        self.done = threading.Event()
+
+class BatchScheduler:
+    """Collects input tensors from camera workers and runs them as one (N,3,H,W) batch.
+
+    A batch is flushed when max_batch_size requests are queued or max_delay_ms has
+    passed since the first one, whichever comes first. Models exported with batch 1
+    are run one request at a time (a fixed batch above 1 is rejected when the session opens).
+    """
+    def __init__(self, session, max_batch_size=8, max_delay_ms=20):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.output_name = session.get_outputs()[0].name
+        self.batching = has_dynamic_batch(session) and max_batch_size > 1
+        self.max_batch_size = max(1, int(max_batch_size)) if self.batching else 1
+        self.max_delay = max(0.0, float(max_delay_ms)) / 1000.0
+        self.queue = queue.Queue()
+        self.batch_buffers = {}
+        self.stopped = False
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def infer(self, tensor):
+        return self.infer_many([tensor])[0]
+
+    def infer_many(self, tensors):
+        """Queues several tensors at once (e.g. zone crops of one frame) so they share a batch."""
+        requests = [InferenceRequest(tensor) for tensor in tensors]
+        for request in requests:
+            self.queue.put(request)
+        for request in requests:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+        return [request.output for request in requests]
+
+    def stop(self):
+        self.stopped = True
+        self.queue.put(None)
+        self.thread.join(timeout=2.0)
+
+    def collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self.stopped = True
+                break
+            batch.append(request)
+        return batch
+
+    def loop(self):
+        while not self.stopped:
+            batch = self.collect()
+            if batch is None:
+                break
+            self.run_batch(batch)
+
+    def get_batch_buffer(self, size, shape):
+        key = (size,) + tuple(shape[1:])
+        buffer = self.batch_buffers.get(key)
+        if buffer is None:
+            buffer = self.batch_buffers[key] = np.empty(key, dtype=np.float32)
+        return buffer
+
+    def run_batch(self, batch):
+        # Камеры могут работать с разным размером входа — стекуем только одинаковые
+        groups = {}
+        for request in batch:
+            groups.setdefault(request.tensor.shape, []).append(request)
+        for shape, requests in groups.items():
             try:
-                config_json = base64.b64decode(config_str).decode('utf-8')
-                config = json.loads(config_json)
-            except Exception:
-                pass
-        
-        objects_to_detect = config.get('objects', None)
-        confidence_threshold = config.get('confidence', 0.5)
-        frame_skip = int(config.get('frame_skip', 5)) or 1
-        frame_grabber = None
-        
-        while True: 
-            if frame_grabber is None or frame_grabber.stopped:
+                if len(requests) == 1:
+                    requests[0].output = run_inference(self.session, self.input_name, self.output_name, requests[0].tensor)
+                else:
+                    stacked = self.get_batch_buffer(len(requests), shape)
+                    np.concatenate([r.tensor for r in requests], axis=0, out=stacked)
+                    output = run_inference(self.session, self.input_name, self.output_name, stacked)
+                    for i, request in enumerate(requests):
+                        request.output = output[i:i + 1]
+            except Exception as e:
+                for request in requests:
+                    request.error = e
+            finally:
+                for request in requests:
+                    request.done.set()
+
+class ModelEntry:
+    __slots__ = ('session', 'scheduler', 'input_width', 'input_height')
+
+    def __init__(self, session, scheduler, input_width, input_height):
+        self.session = session
+        self.scheduler = scheduler
+        self.input_width = input_width
+        self.input_height = input_height
+
+class SessionCache:
+    """Inference sessions keyed by (model path, input size, provider, precision).
+
+    A model with dynamic H/W serves every input size from one session; fixed-size
+    models (yolov8n.onnx or yolov8n_<size>.onnx) get one session per file and force
+    their own input size. get() takes the camera's model_precision, falling back to
+    the cache-wide one, so cameras with different precisions get separate sessions.
+    With max_batch_size > 1 every session gets a BatchScheduler. Sessions are warmed
+    up before get() returns; cache_dir keeps ORT-optimized graphs between process
+    starts (see open_session).
+    """
+    def __init__(self, provider_choice='auto', max_batch_size=1, max_batch_delay_ms=0, cache_dir=None,
+                 precision='auto', threading_config=None):
+        self.provider_choice = provider_choice
+        self.cache_dir = cache_dir
+        self.precision = precision
+        self.threading_config = threading_config
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay_ms = max_batch_delay_ms
+        self.sessions = {}
+        self.model_sizes = {}  # (путь модели, точность) -> None (динамическая) или (w, h)
+        self.lock = threading.Lock()
+
+    def get(self, input_size, precision=None):
+        model_path = find_model_path(input_size)
+        precision = precision or self.precision
+        with self.lock:
+            if (model_path, precision) not in self.model_sizes:
+                session = create_session(self.provider_choice, model_path, self.cache_dir,
+                                         warmup_size=input_size, precision=precision,
+                                         threading_config=self.threading_config)
+                fixed_size = None if has_dynamic_input_size(session) else get_model_input_size(session)
+                self.model_sizes[(model_path, precision)] = fixed_size
+                self.sessions[(model_path, fixed_size, self.provider_choice, precision)] = self.create_entry(session)
+            fixed_size = self.model_sizes[(model_path, precision)]
+            entry = self.sessions[(model_path, fixed_size, self.provider_choice, precision)]
+            if fixed_size is None:
+                return ModelEntry(entry.session, entry.scheduler, input_size, input_size)
+            return entry
+
+    def create_entry(self, session):
+        scheduler = None
+        if self.max_batch_size > 1:
+            scheduler = BatchScheduler(session, self.max_batch_size, self.max_batch_delay_ms)
+        input_width, input_height = get_model_input_size(session)
+        return ModelEntry(session, scheduler, input_width, input_height)
+
+    def close(self):
+        for entry in self.sessions.values():
+            if entry.scheduler is not None:
+                entry.scheduler.stop()
+
+class CameraWorker(PreprocessorCacheMixin):
+    """Inference loop for one RTSP stream on top of a (possibly shared) session."""
+    # Пауза перед перезапуском упавшего цикла анализа, удваивается до максимума
+    RESTART_BACKOFF_MIN = 1.0
+    RESTART_BACKOFF_MAX = 60.0
+
+    def __init__(self, session_cache, rtsp_url, config, camera_id=None):
+        self.config = dict(config)
+        model = session_cache.get(get_config_input_size(config), config.get('model_precision'))
+        self.session = model.session
+        self.scheduler = model.scheduler
+        self.rtsp_url = rtsp_url
+        self.camera_id = camera_id
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+        self.input_width, self.input_height = model.input_width, model.input_height
+        self.postprocessor = Postprocessor(config.get('objects', None), config.get('confidence', 0.5))
+        self.frame_skip = int(config.get('frame_skip', 5)) or 1
+        self.frame_scheduler = FrameScheduler(target_fps=config.get('target_fps'), frame_skip=self.frame_skip)
+        self.motion_gate = None
+        if config.get('motion_gate'):
+            self.motion_gate = MotionGate(threshold=config.get('motion_threshold', 0.01),
+                                          keepalive=config.get('motion_keepalive', 30),
+                                          roi=config.get('roi'))
+        # opencv — полный декод в cv2.VideoCapture; ffmpeg — масштабирование в декодере
+        # и (по желанию) декод только ключевых кадров
+        self.capture_backend = config.get('capture_backend', 'opencv')
+        self.keyframes_only = bool(config.get('keyframes_only', False))
+        self.ffmpeg_path = config.get('ffmpeg_path') or 'ffmpeg'
+        # Трекер: вместо строки на каждый кадр — события появления/обновления/исчезновения
+        self.tracker = None
+        if config.get('tracking', True):
+            self.tracker = Tracker(max_age=float(config.get('track_max_age', 5)),
+                                   update_interval=float(config.get('track_update_interval', 10)))
+        # Рамки 'overlay' нужны, только пока открыт живой просмотр камеры, и не чаще overlay_fps
+        self.overlay = bool(config.get('overlay', False))
+        self.overlay_interval = 1.0 / max(0.1, float(config.get('overlay_fps', 5)))
+        self.last_overlay = 0.0
+        self.overlay_visible = False
+        self.metrics = PipelineMetrics()
+        self.metrics_interval = float(config.get('metrics_interval', config.get('stats_interval', 60)))
+        self.last_metrics_report = time.monotonic()
+        self.profiler = None
+        self.preprocessors = {}
+        # Зоны анализа: инференс только по кропам вокруг них (см. ZoneCropper)
+        self.zone_cropper = ZoneCropper.create(config.get('zones'), self.input_width, self.input_height,
+                                               margin=config.get('zone_margin', 0.1))
+        self.dynamic_batch = has_dynamic_batch(self.session)
+        # Предзапись: последние секунды видео в памяти, сбрасываются в клип при появлении объекта
+        self.preroll = None
+        if float(config.get('preroll_seconds') or 0) > 0 and config.get('preroll_dir'):
+            self.preroll = PreRollBuffer(seconds=config['preroll_seconds'],
+                                         fps=config.get('preroll_fps', 10),
+                                         max_bytes=float(config.get('preroll_max_mb', 32)) * 1024 * 1024,
+                                         width=config.get('preroll_width', 640), ffmpeg_path=self.ffmpeg_path)
+        self.preroll_cooldown = float(config.get('preroll_cooldown', 30))
+        self.last_preroll = 0.0
+        # Снимки событий кодируются в фоне (см. SnapshotWriter); в событие попадают только пути
+        self.snapshots = get_snapshot_writer(config)
+        self.snapshot_interval = float(config.get('snapshot_interval', 10))
+        self.last_snapshot = 0.0
+        # Журнал событий на диске (см. DetectionStore) вместо events.json дашборда
+        self.store = get_detection_store(config)
+        self.frame_grabber = None
+        self.stopped = False
+        self.thread = None
+
+    def update_config(self, config):
+        """Applies settings that do not need a new session or stream; the rest is ignored."""
+        if 'objects' in config or 'confidence' in config:
+            self.postprocessor = Postprocessor(config.get('objects', self.config.get('objects')),
+                                               config.get('confidence', self.config.get('confidence', 0.5)))
+        # Каждый ключ меняет только своё: обновление одного frame_skip не должно
+        # переводить камеру с расписания по времени на счёт кадров
+        if 'target_fps' in config:
+            self.frame_scheduler.target_fps = float(config['target_fps']) if config['target_fps'] else None
+        if 'frame_skip' in config:
+            self.frame_skip = max(1, int(config['frame_skip'] or 1))
+            if not self.decodes_keyframes_only(self.frame_grabber):
+                self.frame_scheduler.frame_skip = self.frame_skip
+        if self.motion_gate is not None:
+            self.motion_gate.threshold = float(config.get('motion_threshold', self.motion_gate.threshold))
+            self.motion_gate.keepalive = float(config.get('motion_keepalive', self.motion_gate.keepalive))
+        if self.tracker is not None:
+            self.tracker.update_interval = float(config.get('track_update_interval', self.tracker.update_interval))
+        if 'metrics_interval' in config:
+            self.metrics_interval = float(config['metrics_interval'])
+        if 'overlay' in config:
+            self.overlay = bool(config['overlay'])
+        if 'overlay_fps' in config:
+            self.overlay_interval = 1.0 / max(0.1, float(config['overlay_fps']))
+        if 'zones' in config or 'zone_margin' in config:
+            zones = config.get('zones', self.config.get('zones'))
+            self.zone_cropper = ZoneCropper.create(zones, self.input_width, self.input_height,
+                                                   margin=config.get('zone_margin', self.config.get('zone_margin', 0.1)))
+        self.config = {**self.config, **config}
+        if config.get('ingest_path') and not isinstance(self.frame_grabber, IngestFrameGrabber):
+            # Открылся живой просмотр: переходим на его кадры, своё RTSP-подключение закрываем
+            if self.frame_grabber is not None:
+                self.frame_grabber.stop()
+
+    def emit(self, payload):
+        if self.camera_id is not None:
+            payload["cameraId"] = self.camera_id
+        emit(payload)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        if self.frame_grabber is not None:
+            self.frame_grabber.stop()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2.0)
+
+    def run(self):
+        # Профилировщик привязан к потоку анализа, поэтому создаётся здесь, а не в __init__
+        self.profiler = create_profiler(self.config)
+        if self.profiler is not None:
+            self.profiler.start()
+        backoff = self.RESTART_BACKOFF_MIN
+        try:
+            while not self.stopped:
+                started = time.monotonic()
+                try:
+                    self.run_loop()
+                except Exception as e:
+                    # Долго проработавший цикл начинает отсчёт пауз заново
+                    if time.monotonic() - started > self.RESTART_BACKOFF_MAX:
+                        backoff = self.RESTART_BACKOFF_MIN
+                    # Сбой анализа не должен молча останавливать камеру: сообщаем и перезапускаем цикл
+                    self.emit({"status": "error", "message": f"Analysis failed, restarting in {backoff:.0f} s: {e}"})
+                    if self.frame_grabber is not None:
+                        self.frame_grabber.stop()
+                        self.frame_grabber = None
+                    deadline = time.monotonic() + backoff
+                    while not self.stopped and time.monotonic() < deadline:
+                        time.sleep(0.2)
+                    backoff = min(backoff * 2, self.RESTART_BACKOFF_MAX)
+        finally:
+            # Подключение, открытое уже после stop() (remove_camera во время долгого коннекта)
+            if self.frame_grabber is not None:
+                self.frame_grabber.stop()
+            if self.profiler is not None:
+                self.profiler.stop()
+
+    def run_loop(self):
+        metrics = self.metrics
+        connected_before = False
+        while not self.stopped:
+            if self.frame_grabber is None or self.frame_grabber.stopped:
+                if connected_before:
+                    metrics.count('reconnects')
                 try:
-                    frame_grabber = FrameGrabber(rtsp_url)
-                    frame_grabber.start()
-                    time.sleep(2) 
+                    self.frame_grabber = self.create_grabber()
+                    self.frame_grabber.metrics = metrics
+                    if self.preroll is not None:
+                        self.frame_grabber.on_frame = self.preroll.add
+                    self.frame_grabber.start()
+                    connected_before = True
                 except IOError as e:
-                    print(json.dumps({"status": "error", "message": str(e)}), flush=True)
+                    self.emit({"status": "error", "message": str(e)})
                     time.sleep(5)
                     continue
-            frame_count = 0
-            while not frame_grabber.stopped:
-                ret, frame = frame_grabber.read()
-                if not ret or frame is None:
-                    time.sleep(0.5)
-                    if frame_grabber.stopped:
-                        break 
+            last_seq = 0
+            while not self.frame_grabber.stopped and not self.stopped:
+                self.report_metrics()
+                waited = time.perf_counter()
+                packet = self.frame_grabber.read_next(last_seq)
+                if packet is None:
                     continue
-                frame_count += 1
-                if frame_count % frame_skip != 0:
+                frame, seq, timestamp = packet
+                metrics.record('wait', time.perf_counter() - waited)
+                if last_seq and seq > last_seq + 1:
+                    # Кадры, перезаписанные потоком захвата раньше, чем цикл анализа их увидел.
+                    # Потеря — только те, что расписание взяло бы; остальные и так пропускались
+                    unseen = seq - last_seq - 1
+                    missed = self.frame_scheduler.missed(unseen, timestamp)
+                    metrics.count('frames_dropped', missed)
+                    metrics.count('frames_skipped', unseen - missed)
+                last_seq = seq
+                stale_before = self.frame_scheduler.dropped_stale
+                if not self.frame_scheduler.should_process(timestamp):
+                    if self.frame_scheduler.dropped_stale != stale_before:
+                        metrics.count('frames_dropped')
+                    else:
+                        metrics.count('frames_skipped')
                     continue
-                input_tensor, ratio, pad = preprocess(frame, input_width, input_height)
-                outputs = session.run([output_name], {input_name: input_tensor})
-                detections = postprocess(outputs[0], ratio, pad, confidence_threshold)
-                
-                filtered_objects = [obj for obj in detections if obj['label'] in objects_to_detect] if objects_to_detect else detections
-
-                if len(filtered_objects) > 0:
-                    result = {
-                        "status": "objects_detected",
-                        "timestamp": time.time(),
-                        "objects": filtered_objects
-                    }
-                    print(json.dumps(result), flush=True)
-    
+                if self.motion_gate is not None:
+                    started = time.perf_counter()
+                    moving = self.motion_gate.check(frame)
+                    metrics.record('motion', time.perf_counter() - started)
+                    # Счётчики ворот — в метриках окна, как пропуски планировщика
+                    metrics.count('motion_passed' if moving else 'motion_skipped')
+                    if not moving:
+                        continue
+                started = time.perf_counter()
+                self.process_frame(frame)
+                self.frame_scheduler.record_latency(time.perf_counter() - started)
+                metrics.count('frames_analyzed')
+
+    def decodes_keyframes_only(self, grabber):
+        # Кадры общего приёма (IngestFrameGrabber) — полный поток, хоть класс и наследник
+        return self.keyframes_only and type(grabber) is FfmpegFrameGrabber
+
+    def create_grabber(self):
+        grabber = self.open_grabber()
+        # Ключевые кадры и так приходят раз в GOP (обычно 1–2 с) — frame_skip к ним не применяем
+        self.frame_scheduler.frame_skip = 1 if self.decodes_keyframes_only(grabber) else self.frame_skip
+        return grabber
+
+    def open_grabber(self):
+        if self.config.get('ingest_path'):
+            try:
+                return IngestFrameGrabber(self.config['ingest_path'])
+            except IOError:
+                pass  # Живой просмотр камеры не открыт — забираем поток сами
+        if self.capture_backend == 'ffmpeg':
+            return FfmpegFrameGrabber(self.rtsp_url, self.input_width, self.input_height,
+                                      keyframes_only=self.keyframes_only, ffmpeg_path=self.ffmpeg_path)
+        return FrameGrabber(self.rtsp_url)
+
+    def report_metrics(self):
+        now = time.monotonic()
+        if now - self.last_metrics_report < self.metrics_interval:
+            return
+        self.last_metrics_report = now
+        report = {"status": "metrics", **self.frame_scheduler.stats(), **self.metrics.snapshot()}
+        if self.profiler is not None:
+            report["profile"] = self.profiler.report()
+        self.emit(report)
+
+    def process_frame(self, frame):
+        metrics = self.metrics
+        t0 = time.perf_counter()
+        # Один раз на кадр: update_config может заменить кроппер из потока команд
+        zone_cropper = self.zone_cropper
+        params = None
+        if zone_cropper is not None:
+            batch, params = zone_cropper.crops(frame)
+        if not params:
+            # Зон нет или ни одна не дала кропа на этом кадре — весь кадр, без фильтра по зонам
+            zone_cropper = None
+            input_tensor, ratio, pad = self.get_preprocessor(frame)(frame)
+            batch, params = input_tensor, [(ratio, pad, (0, 0))]
+        t1 = time.perf_counter()
+        outputs = self.infer(batch)
+        t2 = time.perf_counter()
+        if len(params) == 1:
+            detections = self.postprocessor(outputs[0], *params[0])
+        else:
+            detections = np.concatenate([self.postprocessor(output, *p) for output, p in zip(outputs, params)])
+        if zone_cropper is not None:
+            detections = zone_cropper.filter(detections)
+        t3 = time.perf_counter()
+        metrics.record('preprocess', t1 - t0)
+        metrics.record('inference', t2 - t1)
+        metrics.record('postprocess', t3 - t2)
+        self.publish_detections(detections, frame)
+        metrics.record('emit', time.perf_counter() - t3)
+
+    def infer(self, batch):
+        """Outputs for every item of an (N,3,H,W) batch, one (1, ...) array per item."""
+        items = [batch[i:i + 1] for i in range(batch.shape[0])]
+        if self.scheduler is not None:
+            return self.scheduler.infer_many(items)
+        if len(items) > 1 and self.dynamic_batch:
+            output = run_inference(self.session, self.input_name, self.output_name, batch)
+            return [output[i:i + 1] for i in range(len(items))]
+        return [run_inference(self.session, self.input_name, self.output_name, item) for item in items]
+
+    def publish_detections(self, detections, frame):
+        if self.tracker is not None:
+            events = self.tracker.update(detections)
+            if any(event == 'appeared' for event, _ in events):
+                self.save_preroll()
+            self.emit_track_events(events, frame)
+            self.emit_overlay(detections, frame)
+        elif detections.size > 0:
+            self.save_preroll()
+            payload = {
+                "status": "objects_detected",
+                "timestamp": time.time(),
+                "frame": {"w": frame.shape[1], "h": frame.shape[0]},
+                "objects": detections_to_objects(detections)
+            }
+            # Без трекера событие приходит с каждым кадром — снимок не чаще snapshot_interval
+            now = time.monotonic()
+            if now - self.last_snapshot >= self.snapshot_interval:
+                if self.attach_snapshot(payload, frame):
+                    self.last_snapshot = now
+            self.store_event(payload)
+            self.emit(payload)
+
+    def store_event(self, payload):
+        if self.store is None:
+            return
+        # Событие — появление объекта; периодические 'updated' трекера в журнал не пишутся
+        objects = [obj for obj in payload['objects'] if obj.get('event') in (None, 'appeared')]
+        if not objects:
+            return
+        event = {"t": round(payload['timestamp'], 3), "camera": self.camera_id,
+                 "labels": sorted({obj['label'] for obj in objects}), "objects": objects}
+        if 'snapshot' in payload:
+            event["snapshot"] = payload['snapshot']
+        self.store.append(self.camera_id if self.camera_id is not None else 0, event)
+
+    def attach_snapshot(self, payload, frame):
+        """Queues a snapshot of the event and adds its paths to payload; False if disabled or dropped."""
+        if self.snapshots is None:
+            return False
+        started = time.perf_counter()
+        objects = payload['objects']
+        boxes = [(o['box']['x'], o['box']['y'], o['box']['w'], o['box']['h']) for o in objects]
+        paths = self.snapshots.submit(frame, boxes, self.config.get('snapshot_prefix', 'camera'))
+        self.metrics.record('snapshot', time.perf_counter() - started)
+        if paths is None:
+            self.metrics.count('snapshots_dropped')
+            return False
+        payload['snapshot'], crop_paths = paths
+        for obj, path in zip(objects, crop_paths):
+            obj['snapshot'] = path
+        return True
+
+    def emit_overlay(self, detections, frame):
+        # События трекера редки, а рамкам на видео нужно обновление: лёгкое сообщение
+        # с текущими рамками, пока открыт живой просмотр; пустое — один раз, чтобы стереть старые
+        if not self.overlay or (detections.size == 0 and not self.overlay_visible):
+            return
+        now = time.monotonic()
+        if detections.size > 0 and now - self.last_overlay < self.overlay_interval:
+            return
+        self.last_overlay = now
+        self.overlay_visible = detections.size > 0
+        self.emit({
+            "status": "overlay",
+            "timestamp": time.time(),
+            "frame": {"w": frame.shape[1], "h": frame.shape[0]},
+            "objects": detections_to_objects(detections)
+        })
+
+    def save_preroll(self):
+        # Пока идёт запись, вызванная прошлым событием, новый клип не нужен
+        now = time.monotonic()
+        if self.preroll is None or now - self.last_preroll < self.preroll_cooldown:
+            return
+        if self.preroll.flush(self.config['preroll_dir'], self.config.get('preroll_prefix', 'camera'), self.emit):
+            self.last_preroll = now
+
+    def emit_track_events(self, events, frame):
+        if not events:
+            return
+        timestamp = time.time()
+        active = [track.to_object(event) for event, track in events if event != 'disappeared']
+        lost = [track.to_object(event) for event, track in events if event == 'disappeared']
+        if active:
+            payload = {
+                "status": "objects_detected",
+                "timestamp": timestamp,
+                "frame": {"w": frame.shape[1], "h": frame.shape[0]},
+                "objects": active
+            }
+            # Снимок — только когда появился новый объект, не на периодических 'updated'
+            if any(obj['event'] == 'appeared' for obj in active):
+                self.attach_snapshot(payload, frame)
+                self.store_event(payload)
+            self.emit(payload)
+        if lost:
+            self.emit({"status": "objects_lost", "timestamp": timestamp, "objects": lost})
+
+def run_analytics(rtsp_url, config_str, provider_choice='auto'):
+    try:
+        config = parse_config(config_str)
+        apply_cpu_affinity(config.get('cpu_affinity'))
+        session_cache = SessionCache(provider_choice, cache_dir=get_cache_dir(config),
+                                     precision=config.get('model_precision', 'auto'), threading_config=config)
+        worker = CameraWorker(session_cache, rtsp_url, config)
+        worker.run()
+    except Exception as e:
+        emit({"status": "error", "message": f"CRITICAL RUNTIME ERROR: {str(e)}"})
+        sys.exit(1)
+
+# --- Серверный режим: один процесс, одна сессия, N камер ---
+# Управление построчным JSON через stdin:
+#   {"cmd": "add_camera", "camera_id": 1, "rtsp_url": "rtsp://...", "config": {...}}
+#   {"cmd": "remove_camera", "camera_id": 1}
+#   {"cmd": "shutdown"}
+#   {"cmd": "update_config", "camera_id": 1, "config": {...}}  — пороги и частоты без перезапуска
+# Общий приём (shared ingest): config.ingest_path — сокет/канал, в который дашборд отдаёт
+# кадры своего живого просмотра; пока он недоступен, камера читается по rtsp_url.
+# update_config с ingest_path переключает работающую камеру на этот источник.
+# config.events_dir — каталог журнала событий (DetectionStore), config.snapshot_dir — снимков.
+# Необязательный base64-конфиг сервера: max_batch_size, max_batch_delay_ms, resize_width
+# (размер входа, модель под который загружается сразу при старте), protocol ('json' или
+# 'binary'), ipc_path (сокет/канал для бинарного вывода вместо stdout), flush_interval_ms,
+# model_cache_dir (каталог для оптимизированных ORT-графов; '' — без кэша),
+# model_precision ('auto' — по провайдеру, либо 'fp32', 'fp16', 'int8'), потоки ORT
+# (intra_op_threads, inter_op_threads, execution_mode, allow_spinning), cpu_affinity
+# (список ядер) и workers (> 1 — режим супервизора, см. run_supervisor).
+
+def setup_output_channel(server_config):
+    if server_config.get('protocol') != 'binary':
+        return
+    ipc_path = server_config.get('ipc_path')
+    stream = open_ipc_endpoint(ipc_path) if ipc_path else sys.stdout.buffer
+    set_channel(BinaryChannel(stream, flush_interval_ms=server_config.get('flush_interval_ms', 50)))
+
+def run_server(provider_choice='auto', config_str=None):
+    server_config = parse_config(config_str)
+    setup_output_channel(server_config)
+    if int(server_config.get('workers') or 1) > 1:
+        return run_supervisor(provider_choice, server_config)
+    apply_cpu_affinity(server_config.get('cpu_affinity'))
+    session_cache = SessionCache(provider_choice,
+                                 max_batch_size=server_config.get('max_batch_size', 8),
+                                 max_batch_delay_ms=server_config.get('max_batch_delay_ms', 20),
+                                 cache_dir=get_cache_dir(server_config),
+                                 precision=server_config.get('model_precision', 'auto'),
+                                 threading_config=server_config)
+    try:
+        model = session_cache.get(get_config_input_size(server_config))
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"CRITICAL RUNTIME ERROR: {str(e)}"}), flush=True)
+        emit({"status": "error", "message": f"CRITICAL RUNTIME ERROR: {str(e)}"})
         sys.exit(1)
 
+    workers = {}
+    emit({"status": "ready", "batching": model.scheduler is not None and model.scheduler.batching,
+          "max_batch_size": session_cache.max_batch_size, "labels": COCO_LABELS,
+          "time_to_ready_ms": round((time.monotonic() - PROCESS_STARTED) * 1000)})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            command = json.loads(line)
+        except ValueError:
+            emit({"status": "error", "message": f"Invalid control message: {line}"})
+            continue
+
+        cmd = command.get('cmd')
+        camera_id = command.get('camera_id')
+        try:
+            if cmd == 'add_camera':
+                if camera_id in workers:
+                    workers.pop(camera_id).stop()
+                config = command.get('config') or {}
+                worker = CameraWorker(session_cache, command['rtsp_url'], config, camera_id=camera_id)
+                workers[camera_id] = worker
+                worker.start()
+                emit({"status": "camera_added", "cameraId": camera_id})
+            elif cmd == 'remove_camera':
+                worker = workers.pop(camera_id, None)
+                if worker is not None:
+                    worker.stop()
+                emit({"status": "camera_removed", "cameraId": camera_id})
+            elif cmd == 'update_config':
+                worker = workers.get(camera_id)
+                if worker is None:
+                    raise KeyError(f"Camera {camera_id} is not running")
+                worker.update_config(command.get('config') or {})
+                emit({"status": "config_updated", "cameraId": camera_id})
+            elif cmd == 'shutdown':
+                break
+            else:
+                emit({"status": "error", "message": f"Unknown command: {cmd}"})
+        except Exception as e:
+            emit({"status": "error", "cameraId": camera_id, "message": str(e)})
+
+    for worker in workers.values():
+        worker.stop()
+    close_detection_stores()
+    session_cache.close()
+    _channel.close()
+
+# --- Супервизор: N серверов-воркеров, каждый на своей части ядер ---
+# Одна сессия на все ядра упирается в масштабирование intra-op пула, а N процессов
+# без ограничений дерутся за одни и те же ядра. Супервизор делит ядра поровну,
+# запускает на каждой части обычный --server и раскладывает камеры на наименее
+# загруженный воркер. Протокол с Electron тот же: команды в stdin, сообщения через emit.
+
+def partition_cores(cores, workers):
+    """Splits cores into `workers` contiguous, near-equal groups (never empty)."""
+    workers = max(1, min(workers, len(cores)))
+    size, extra = divmod(len(cores), workers)
+    groups, start = [], 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+class InferenceWorkerProcess:
+    """One `--server` child pinned to a core group; restarts itself and its cameras on exit."""
+    def __init__(self, index, provider_choice, config):
+        self.index = index
+        self.provider_choice = provider_choice
+        self.config = config
+        self.cameras = {}  # camera_id -> последняя команда add_camera (для повторной отправки)
+        self.ready = threading.Event()
+        self.ready_message = None
+        self.stopping = False
+        self.lock = threading.Lock()
+        self.process = None
+
+    def command_line(self):
+        config_arg = base64.b64encode(json.dumps(self.config).encode('utf-8')).decode('ascii')
+        script = [] if getattr(sys, 'frozen', False) else [os.path.abspath(__file__)]
+        return [sys.executable, *script, '--server', self.provider_choice, config_arg]
+
+    def start(self):
+        self.ready.clear()
+        self.process = subprocess.Popen(self.command_line(), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        text=True, encoding='utf-8', bufsize=1)
+        threading.Thread(target=self.read_loop, args=(self.process,), daemon=True).start()
+
+    def send(self, command):
+        with self.lock:
+            try:
+                self.process.stdin.write(json.dumps(command) + '\n')
+                self.process.stdin.flush()
+            except (OSError, ValueError):
+                pass  # процесс упал; read_loop перезапустит его и повторит камеры
+
+    def read_loop(self, process):
+        for line in process.stdout:
+            try:
+                payload = json.loads(line)
+            except ValueError:
+                continue
+            status = payload.get('status')
+            if status == 'ready':
+                self.ready_message = payload
+                self.ready.set()
+                continue
+            if status == 'info' and self.index != 0 and not payload.get('error'):
+                continue  # провайдер у всех воркеров один — сообщаем один раз
+            emit(payload)
+        process.wait()
+        # Не поднявшийся воркер не перезапускаем: это ошибка конфигурации, её увидит run_supervisor
+        if self.stopping or not self.ready.is_set():
+            return
+        emit({"status": "error", "message": f"Inference worker {self.index} exited with code "
+                                            f"{process.returncode}, restarting"})
+        time.sleep(1)
+        if self.stopping:
+            return
+        self.start()
+        if self.ready.wait(60):
+            for command in list(self.cameras.values()):
+                self.send(command)
+
+    def add_camera(self, command):
+        self.cameras[command.get('camera_id')] = command
+        self.send(command)
+
+    def remove_camera(self, command):
+        self.cameras.pop(command.get('camera_id'), None)
+        self.send(command)
+
+    def update_config(self, command):
+        stored = self.cameras.get(command.get('camera_id'))
+        if stored is not None:
+            stored['config'] = {**(stored.get('config') or {}), **(command.get('config') or {})}
+        self.send(command)
+
+    def stop(self):
+        self.stopping = True
+        self.send({"cmd": "shutdown"})
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+def run_supervisor(provider_choice, server_config):
+    groups = partition_cores(available_cores(), int(server_config['workers']))
+    affinity = cpu_affinity_supported()
+    if not affinity:
+        # Воркеры всё равно делят ядра по числу потоков ORT, но ОС может ставить их куда угодно
+        emit({"status": "info", "warning": "CPU affinity is not available on this system (install psutil); "
+                                           "inference workers are not pinned to cores"})
+    workers = []
+    for index, cores in enumerate(groups):
+        # Воркеру — только свои ядра: intra-op пул по их числу, без активного ожидания
+        config = {**server_config, 'workers': 1, 'protocol': 'json', 'cpu_affinity': cores,
+                  'intra_op_threads': server_config.get('intra_op_threads') or len(cores),
+                  'inter_op_threads': server_config.get('inter_op_threads') or 1,
+                  'allow_spinning': server_config.get('allow_spinning', False)}
+        config.pop('ipc_path', None)
+        workers.append(InferenceWorkerProcess(index, provider_choice, config))
+    for worker in workers:
+        worker.start()
+    deadline = time.monotonic() + 120
+    for worker in workers:
+        while not worker.ready.wait(0.1) and worker.process.poll() is None and time.monotonic() < deadline:
+            pass
+        if not worker.ready.is_set():
+            emit({"status": "error", "message": f"CRITICAL RUNTIME ERROR: inference worker {worker.index} did not start"})
+            for other in workers:
+                other.stop()
+            _channel.close()
+            sys.exit(1)
+
+    first = workers[0].ready_message
+    emit({"status": "ready", "batching": first.get('batching'), "max_batch_size": first.get('max_batch_size'),
+          "labels": first.get('labels'), "workers": [len(cores) for cores in groups], "cpu_affinity": affinity,
+          "time_to_ready_ms": round((time.monotonic() - PROCESS_STARTED) * 1000)})
+
+    placement = {}  # camera_id -> воркер
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            command = json.loads(line)
+        except ValueError:
+            emit({"status": "error", "message": f"Invalid control message: {line}"})
+            continue
+
+        cmd = command.get('cmd')
+        camera_id = command.get('camera_id')
+        if cmd == 'add_camera':
+            worker = placement.pop(camera_id, None)
+            if worker is not None:
+                worker.remove_camera({"cmd": "remove_camera", "camera_id": camera_id})
+            worker = min(workers, key=lambda w: (len(w.cameras), w.index))
+            placement[camera_id] = worker
+            worker.add_camera(command)
+        elif cmd == 'remove_camera':
+            worker = placement.pop(camera_id, None)
+            if worker is not None:
+                worker.remove_camera(command)
+            else:
+                emit({"status": "camera_removed", "cameraId": camera_id})
+        elif cmd == 'update_config':
+            worker = placement.get(camera_id)
+            if worker is None:
+                emit({"status": "error", "cameraId": camera_id, "message": f"Camera {camera_id} is not running"})
+            else:
+                worker.update_config(command)
+        elif cmd == 'shutdown':
+            break
+        else:
+            emit({"status": "error", "message": f"Unknown command: {cmd}"})
+
+    for worker in workers:
+        worker.stop()
+    _channel.close()
+
+# --- Анализ записей архива: файлы целиком, быстрее реального времени ---
+# analytics.py --analyze-files <provider> <config_b64> <файл или каталог> [...]
+# Конфиг: objects, confidence, resize_width, target_fps (частота выборки, по умолчанию 2),
+# batch_size, jobs (число процессов; ядра делятся между ними, как у супервизора).
+# Рядом с записью появляется индекс <запись>.detections.json (см. FileAnalyzer.build_index).
+# Сообщения: file_progress, file_done, file_error и итоговое analysis_done.
+
+RECORDING_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.ts')
+INDEX_SUFFIX = '.detections.json'
+INDEX_VERSION = 1
+
+def list_recordings(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.lower().endswith(RECORDING_EXTENSIONS))
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+class FileAnalyzer(PreprocessorCacheMixin):
+    """Decodes a recording without pacing, samples it at target_fps and infers in batches.
+
+    Skipped frames are only grab()-ed, so they are never converted to BGR. Sampled frames
+    are letterboxed straight into a reused batch tensor; models without a dynamic batch
+    axis fall back to batches of one.
+    """
+    PROGRESS_INTERVAL = 1.0
+
+    def __init__(self, session, config):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.output_name = session.get_outputs()[0].name
+        if has_dynamic_input_size(session):
+            self.input_width = self.input_height = get_config_input_size(config)
+        else:
+            self.input_width, self.input_height = get_model_input_size(session)
+        self.batch_size = max(1, int(config.get('batch_size', 8))) if has_dynamic_batch(session) else 1
+        self.batch = np.empty((self.batch_size, 3, self.input_height, self.input_width), dtype=np.float32)
+        self.postprocessor = Postprocessor(config.get('objects', None), config.get('confidence', 0.5))
+        self.target_fps = float(config.get('target_fps', 2) or 0)
+        self.preprocessors = {}
+
+    def infer(self, pending):
+        output = run_inference(self.session, self.input_name, self.output_name, self.batch[:len(pending)])
+        return [(timestamp, self.postprocessor(output[i:i + 1], ratio, pad))
+                for i, (timestamp, ratio, pad) in enumerate(pending)]
+
+    def analyze(self, path):
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise IOError(f"Cannot open {path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+        step = max(1, round(fps / self.target_fps)) if self.target_fps else 1
+        started = last_report = time.monotonic()
+        decoded, pending, samples = 0, [], []
+        try:
+            while capture.grab():
+                position = decoded
+                decoded += 1
+                if position % step:
+                    continue
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                tensor, ratio, pad = self.get_preprocessor(frame)(frame)
+                np.copyto(self.batch[len(pending)], tensor[0])
+                pending.append((position / fps, ratio, pad))
+                if len(pending) == self.batch_size:
+                    samples += self.infer(pending)
+                    pending = []
+                now = time.monotonic()
+                if now - last_report >= self.PROGRESS_INTERVAL:
+                    last_report = now
+                    emit({"status": "file_progress", "file": path,
+                          "progress": round(decoded / total, 3) if total else None,
+                          "decode_fps": round(decoded / (now - started), 1)})
+            if pending:
+                samples += self.infer(pending)
+        finally:
+            capture.release()
+        elapsed = time.monotonic() - started
+
+        index = self.build_index(path, fps, decoded, step / fps, samples)
+        index_path = path + INDEX_SUFFIX
+        temp_path = index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(temp_path, index_path)
+        return {"file": path, "index": index_path, "frames_decoded": decoded, "frames_analyzed": len(samples),
+                "detections": len(index['detections']), "seconds": round(elapsed, 2),
+                "decode_fps": round(decoded / elapsed, 1) if elapsed > 0 else None}
+
+    def build_index(self, path, fps, decoded, sample_interval, samples):
+        """Compact per-file index: one row per detection plus merged per-label time segments.
+
+        detections rows are [t, label index, confidence, x, y, w, h] with t in seconds
+        from the start of the file and labels indexing the `labels` table. segments map a
+        label to [start, end] intervals, which is what an archive search needs first.
+        """
+        labels, rows, seen = [], [], {}
+        for timestamp, detections in samples:
+            for detection in detections:
+                label = COCO_LABELS[detection['class_id']]
+                if label not in seen:
+                    seen[label] = len(labels)
+                    labels.append(label)
+                x1, y1, x2, y2 = (int(detection[k]) for k in ('x1', 'y1', 'x2', 'y2'))
+                rows.append([round(timestamp, 2), seen[label], round(float(detection['confidence']), 2),
+                             x1, y1, x2 - x1, y2 - y1])
+
+        # Соседние выборки с одной меткой склеиваются, если между ними не больше двух интервалов
+        segments = {}
+        for timestamp, label_index, *_ in rows:
+            intervals = segments.setdefault(labels[label_index], [])
+            if intervals and timestamp - intervals[-1][1] <= 2 * sample_interval:
+                intervals[-1][1] = round(timestamp + sample_interval, 2)
+            elif not intervals or timestamp > intervals[-1][1]:
+                intervals.append([timestamp, round(timestamp + sample_interval, 2)])
+        return {"version": INDEX_VERSION, "file": os.path.basename(path), "fps": round(fps, 3),
+                "duration": round(decoded / fps, 2), "sample_interval": round(sample_interval, 3),
+                "labels": labels, "segments": segments, "detections": rows}
+
+_file_analyzer = None
+
+def init_file_worker(provider_choice, config, core_groups, messages):
+    global _file_analyzer
+    set_channel(QueueChannel(messages))
+    cores = core_groups.get()
+    apply_cpu_affinity(cores)
+    config = {**config, 'intra_op_threads': config.get('intra_op_threads') or len(cores),
+              'inter_op_threads': config.get('inter_op_threads') or 1}
+    session = create_session(provider_choice, find_model_path(get_config_input_size(config)), get_cache_dir(config),
+                             precision=config.get('model_precision', 'auto'), threading_config=config)
+    _file_analyzer = FileAnalyzer(session, config)
+
+def analyze_file_in_worker(path):
+    return _file_analyzer.analyze(path)
+
+def analyze_files(provider_choice, config_str, paths):
+    config = parse_config(config_str)
+    files = list_recordings(paths)
+    if not files:
+        emit({"status": "error", "message": "No recordings to analyze"})
+        return
+    jobs = max(1, min(int(config.get('jobs') or 1), len(files)))
+    groups = partition_cores(available_cores(), jobs)
+    jobs = len(groups)
+
+    manager = multiprocessing.Manager()
+    core_groups, messages = manager.Queue(), manager.Queue()
+    for cores in groups:
+        core_groups.put(cores)
+    started = time.monotonic()
+    totals = {"files": len(files), "failed": 0, "frames_decoded": 0, "frames_analyzed": 0, "detections": 0}
+    reported_info = set()
+
+    def forward_messages():
+        while not messages.empty():
+            payload = messages.get()
+            if payload.get('status') == 'info':
+                # Каждый процесс сообщает о провайдере; достаточно одного раза
+                key = json.dumps(payload.get('provider')) + json.dumps(payload.get('error'))
+                if key in reported_info:
+                    continue
+                reported_info.add(key)
+            emit(payload)
+
+    with ProcessPoolExecutor(jobs, initializer=init_file_worker,
+                             initargs=(provider_choice, config, core_groups, messages)) as pool:
+        futures = {pool.submit(analyze_file_in_worker, path): path for path in files}
+        while futures:
+            done, _ = wait(futures, timeout=0.5, return_when=FIRST_COMPLETED)
+            forward_messages()
+            for future in done:
+                path = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    totals["failed"] += 1
+                    emit({"status": "file_error", "file": path, "message": str(e)})
+                    continue
+                for key in ("frames_decoded", "frames_analyzed", "detections"):
+                    totals[key] += result[key]
+                emit({"status": "file_done", **result})
+    forward_messages()
+    manager.shutdown()
+
+    elapsed = time.monotonic() - started
+    emit({"status": "analysis_done", **totals, "jobs": jobs, "seconds": round(elapsed, 2),
+          "decode_fps": round(totals["frames_decoded"] / elapsed, 1) if elapsed > 0 else None})
+
 if __name__ == "__main__":
+    # Процессы анализа файлов в собранном PyInstaller-бинарнике
+    multiprocessing.freeze_support()
     try:
-        if len(sys.argv) > 1:
+        if len(sys.argv) > 1 and sys.argv[1] == '--analyze-files':
+            provider_arg = sys.argv[2] if len(sys.argv) > 2 else 'auto'
+            config_arg = sys.argv[3] if len(sys.argv) > 3 else None
+            analyze_files(provider_arg, config_arg, sys.argv[4:])
+        elif len(sys.argv) > 1 and sys.argv[1] == '--server':
+            provider_arg = sys.argv[2] if len(sys.argv) > 2 else 'auto'
+            config_arg = sys.argv[3] if len(sys.argv) > 3 else None
+            run_server(provider_arg, config_arg)
+        elif len(sys.argv) > 1:
             rtsp_stream_url = sys.argv[1]
             config_arg = sys.argv[2] if len(sys.argv) > 2 else None
             provider_arg = sys.argv[3] if len(sys.argv) > 3 else 'auto'
             run_analytics(rtsp_stream_url, config_arg, provider_arg)
         else:
-            print(json.dumps({"status": "error", "message": "RTSP URL not provided"}), flush=True)
+            emit({"status": "error", "message": "RTSP URL not provided"})
             sys.exit(1)
     except Exception as e:
-        print(json.dumps({"status": "error", "message": f"CRITICAL STARTUP ERROR: {str(e)}"}), flush=True)
-        sys.exit(1)
\ No newline at end of file
+        emit({"status": "error", "message": f"CRITICAL STARTUP ERROR: {str(e)}"})
+        _channel.close()
+        sys.exit(1)
@@ -1,6 +1,7 @@
 # python_src/analytics.spec
 
 # -*- mode: python ; coding: utf-8 -*-
+import glob
 import os
 import sys
 from PyInstaller.utils.hooks import collect_data_files, collect_dynamic_libs
@@ -19,6 +20,8 @@ datas = [
     (os.path.join(SPEC_DIR, 'yolov8n.onnx'), '.'),
     *collect_data_files('ultralytics')
 ]
+# Модели под фиксированный размер входа и варианты INT8/FP16 (export_model.py --sizes/--int8/--fp16)
+datas += [(path, '.') for path in sorted(glob.glob(os.path.join(SPEC_DIR, 'yolov8n_*.onnx')))]
 
 # Собираем бинарные файлы (.dll, .so) для onnxruntime и cv2.
 binaries = []
@@ -34,6 +37,7 @@ hiddenimports = [
     'ultralytics',
     'ultralytics.engine.results',
     'PIL',
+    'psutil',
 ]
 
 # Исключаем ненужные тяжелые библиотеки
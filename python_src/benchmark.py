@@ -0,0 +1,328 @@
+# benchmark.py
+# Бенчмарки конвейера аналитики. Камера и сеть не нужны.
+#   python benchmark.py preprocess --source 1920x1080 --input 640x640
+#   python benchmark.py make-fixture fixtures/street.mp4 --frames 300
+#   python benchmark.py pipeline --video fixtures/street.mp4 --output results.json
+#   python benchmark.py pipeline --synthetic 1280x720 --baseline results.json
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import analytics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PIPELINE_STAGES = ("decode", "preprocess", "inference", "postprocess", "serialize")
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def summarize(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "mean_ms": round(float(samples.mean()), 4),
+        "p50_ms": round(float(np.percentile(samples, 50)), 4),
+        "p90_ms": round(float(np.percentile(samples, 90)), 4),
+        "p99_ms": round(float(np.percentile(samples, 99)), 4),
+    }
+
+
+def time_call(func, iterations, warmup):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return samples
+
+
+def peak_allocation(func):
+    # numpy сообщает о своих буферах в tracemalloc, так что видны и временные массивы
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_preprocess(args):
+    src_width, src_height = parse_size(args.source)
+    input_width, input_height = parse_size(args.input)
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(src_height, src_width, 3), dtype=np.uint8)
+
+    preprocessor = analytics.Preprocessor(src_width, src_height, input_width, input_height)
+    legacy_tensor, legacy_ratio, legacy_pad = analytics.preprocess(frame, input_width, input_height)
+    tensor, ratio, pad = preprocessor(frame)
+    if legacy_pad != pad or abs(legacy_ratio - ratio) > 1e-9 or not np.allclose(legacy_tensor, tensor, atol=1e-6):
+        raise SystemExit("Preprocessor output differs from preprocess()")
+
+    def legacy():
+        # preprocess() отдаёт транспонированный вид; session.run всё равно делает из него
+        # непрерывную копию, поэтому она входит в замер
+        return np.ascontiguousarray(analytics.preprocess(frame, input_width, input_height)[0])
+
+    results = {}
+    for name, func in (("preprocess", legacy), ("Preprocessor", lambda: preprocessor(frame))):
+        results[name] = summarize(time_call(func, args.iterations, args.warmup))
+        results[name]["peak_alloc_bytes"] = peak_allocation(func)
+    results["speedup"] = round(results["preprocess"]["mean_ms"] / results["Preprocessor"]["mean_ms"], 2)
+    return results
+
+
+class SyntheticSource:
+    """Deterministic frames: a fixed noisy background with a few moving rectangles."""
+    def __init__(self, width, height, seed=0):
+        rng = np.random.default_rng(seed)
+        self.background = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        self.frame = np.empty_like(self.background)
+        self.colors = rng.integers(0, 256, size=(4, 3)).tolist()
+        self.index = 0
+
+    def read(self):
+        height, width = self.background.shape[:2]
+        np.copyto(self.frame, self.background)
+        for i, color in enumerate(self.colors):
+            x = (self.index * (3 + i) + i * width // 4) % width
+            y = height // 5 * (i + 1) - height // 10
+            cv2.rectangle(self.frame, (x, y), (x + width // 10, y + height // 6), color, -1)
+        self.index += 1
+        return True, self.frame
+
+    def release(self):
+        pass
+
+
+class VideoFileSource:
+    """Frames from a local file as fast as they decode; loops when the file ends."""
+    def __init__(self, path):
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise SystemExit(f"Cannot open video file {path}")
+
+    def read(self):
+        ret, frame = self.capture.read()
+        if not ret:
+            self.capture.release()
+            self.capture = cv2.VideoCapture(self.path)
+            ret, frame = self.capture.read()
+        return ret, frame
+
+    def release(self):
+        self.capture.release()
+
+
+def peak_rss_mb():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux отдаёт килобайты, macOS — байты
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except Exception:
+        return None
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def make_fixture(args):
+    width, height = parse_size(args.size)
+    os.makedirs(os.path.dirname(os.path.abspath(args.path)), exist_ok=True)
+    writer = cv2.VideoWriter(args.path, cv2.VideoWriter_fourcc(*"mp4v"), args.fps, (width, height))
+    if not writer.isOpened():
+        raise SystemExit(f"Cannot write {args.path}")
+    source = SyntheticSource(width, height, seed=args.seed)
+    for _ in range(args.frames):
+        writer.write(source.read()[1])
+    writer.release()
+    return {"path": args.path, "frames": args.frames, "size": args.size, "fps": args.fps}
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Relative change of stage p50s and throughput against a previous results file."""
+    comparison, regressions = {}, []
+    for stage in PIPELINE_STAGES:
+        old = baseline.get("stages", {}).get(stage, {}).get("p50_ms")
+        new = results["stages"][stage]["p50_ms"]
+        if old:
+            change = (new - old) / old
+            comparison[f"{stage}_p50"] = round(change, 3)
+            if change > tolerance:
+                regressions.append(f"{stage} p50 {old} -> {new} ms")
+    old_fps = baseline.get("throughput", {}).get("fps")
+    if old_fps:
+        change = (results["throughput"]["fps"] - old_fps) / old_fps
+        comparison["fps"] = round(change, 3)
+        if change < -tolerance:
+            regressions.append(f"fps {old_fps} -> {results['throughput']['fps']}")
+    return comparison, regressions
+
+
+def bench_pipeline(args):
+    # Служебные сообщения analytics (провайдер и т.п.) не должны смешиваться с результатом
+    analytics.set_channel(analytics.JsonChannel(sys.stderr))
+    model_path = args.model or os.path.join(analytics.application_path, f"{analytics.MODEL_NAME}.onnx")
+
+    started = time.perf_counter()
+    session = analytics.create_session(args.provider, model_path)
+    session_ms = (time.perf_counter() - started) * 1000.0
+    input_name = session.get_inputs()[0].name
+    output_name = session.get_outputs()[0].name
+    if analytics.has_dynamic_input_size(session):
+        input_width = input_height = analytics.get_config_input_size({"resize_width": args.input_size})
+    else:
+        input_width, input_height = analytics.get_model_input_size(session)
+
+    if args.video:
+        source = VideoFileSource(args.video)
+    else:
+        source = SyntheticSource(*parse_size(args.synthetic), seed=args.seed)
+    postprocessor = analytics.Postprocessor(args.objects or None, args.confidence)
+    preprocessors = {}
+    samples = {stage: [] for stage in PIPELINE_STAGES}
+    first_inference_ms = None
+    detections_total = 0
+
+    loop_started = time.perf_counter()
+    for index in range(args.warmup + args.frames):
+        t0 = time.perf_counter()
+        ret, frame = source.read()
+        if not ret:
+            raise SystemExit("Source returned no frame")
+        t1 = time.perf_counter()
+        key = (frame.shape[1], frame.shape[0], input_width, input_height)
+        preprocessor = preprocessors.get(key) or preprocessors.setdefault(key, analytics.Preprocessor(*key))
+        tensor, ratio, pad = preprocessor(frame)
+        t2 = time.perf_counter()
+        output = analytics.run_inference(session, input_name, output_name, tensor)
+        t3 = time.perf_counter()
+        detections = postprocessor(output, ratio, pad)
+        t4 = time.perf_counter()
+        if detections.size:
+            payload = {"status": "objects_detected", "timestamp": time.time(), "cameraId": 0,
+                       "objects": analytics.detections_to_objects(detections)}
+            if args.protocol == "binary":
+                analytics.BinaryChannel.pack(payload)
+            else:
+                json.dumps(payload)
+        t5 = time.perf_counter()
+
+        if first_inference_ms is None:
+            first_inference_ms = (t3 - t2) * 1000.0
+        if index == args.warmup - 1:
+            loop_started = time.perf_counter()
+        if index < args.warmup:
+            continue
+        detections_total += int(detections.size)
+        for stage, (begin, end) in zip(PIPELINE_STAGES, ((t0, t1), (t1, t2), (t2, t3), (t3, t4), (t4, t5))):
+            samples[stage].append((end - begin) * 1000.0)
+    wall = time.perf_counter() - loop_started
+    source.release()
+
+    cores = available_cores()
+    fps = args.frames / wall if wall > 0 else 0.0
+    results = {
+        "config": {
+            "source": args.video or f"synthetic:{args.synthetic}",
+            "model": os.path.basename(model_path),
+            "provider": session.get_providers()[0],
+            "input": f"{input_width}x{input_height}",
+            "frames": args.frames,
+            "protocol": args.protocol,
+            "python": platform.python_version(),
+            "onnxruntime": analytics.ort.__version__,
+            "platform": platform.platform(),
+            "cores": cores,
+        },
+        "startup": {
+            "session_ms": round(session_ms, 1),
+            "first_inference_ms": round(first_inference_ms, 1),
+        },
+        "stages": {stage: summarize(values) for stage, values in samples.items()},
+        "throughput": {
+            "fps": round(fps, 2),
+            "fps_per_core": round(fps / cores, 2),
+            "detections": detections_total,
+        },
+        "memory": {"peak_rss_mb": peak_rss_mb()},
+    }
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            comparison, regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        results["comparison"] = comparison
+        results["regressions"] = regressions
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analytics pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="preprocess() vs Preprocessor")
+    preprocess_parser.add_argument("--source", default="1920x1080", help="source frame size, WxH")
+    preprocess_parser.add_argument("--input", default="640x640", help="model input size, WxH")
+    preprocess_parser.add_argument("--iterations", type=int, default=200)
+    preprocess_parser.add_argument("--warmup", type=int, default=10)
+    preprocess_parser.set_defaults(func=bench_preprocess)
+
+    fixture_parser = subparsers.add_parser("make-fixture", help="write a synthetic test video")
+    fixture_parser.add_argument("path")
+    fixture_parser.add_argument("--size", default="1280x720", help="frame size, WxH")
+    fixture_parser.add_argument("--frames", type=int, default=300)
+    fixture_parser.add_argument("--fps", type=int, default=25)
+    fixture_parser.add_argument("--seed", type=int, default=0)
+    fixture_parser.set_defaults(func=make_fixture)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="end-to-end pipeline on a local file or synthetic frames")
+    source_group = pipeline_parser.add_mutually_exclusive_group()
+    source_group.add_argument("--video", help="local video file")
+    source_group.add_argument("--synthetic", default="1280x720", help="synthetic frame size, WxH")
+    pipeline_parser.add_argument("--model", help="ONNX model (default: yolov8n.onnx next to analytics.py)")
+    pipeline_parser.add_argument("--provider", default="cpu", choices=["auto", "dml", "cpu"])
+    pipeline_parser.add_argument("--input-size", type=int, default=640, help="input size for dynamic-shape models")
+    pipeline_parser.add_argument("--objects", nargs="*", default=[], help="label filter, as in analyticsConfig.objects")
+    pipeline_parser.add_argument("--confidence", type=float, default=0.5)
+    pipeline_parser.add_argument("--protocol", default="json", choices=["json", "binary"], help="serializer to time")
+    pipeline_parser.add_argument("--frames", type=int, default=200)
+    pipeline_parser.add_argument("--warmup", type=int, default=10)
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser.add_argument("--output", help="write results as JSON")
+    pipeline_parser.add_argument("--baseline", help="results JSON of a previous run to compare against")
+    pipeline_parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative slowdown vs baseline")
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    results = args.func(args)
+    print(json.dumps(results, indent=2))
+    if results.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
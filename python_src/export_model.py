@@ -1,12 +1,217 @@
 # export_model.py
-from ultralytics import YOLO
+import argparse
+import glob
+import json
+import os
+import time
 
-# Загружаем стандартную модель YOLOv8n
-model = YOLO("yolov8n.pt")
+parser = argparse.ArgumentParser(description="Export YOLOv8n to ONNX for analytics.py")
+# По умолчанию оси batch/height/width динамические: одна модель обслуживает любой
+# analytics_resize_width, а BatchScheduler может склеивать кадры в батч.
+# --static экспортирует модель с фиксированным входом (1,3,640,640), как раньше.
+parser.add_argument("--static", action="store_true", help="export with a fixed (1,3,640,640) input")
+# Дополнительно можно выпустить модели под конкретные размеры (yolov8n_416.onnx и т.д.).
+# analytics.py выбирает их вместо yolov8n.onnx, если размер совпадает с resize_width.
+parser.add_argument("--sizes", type=int, nargs="*", default=[], help="also export fixed-size models, e.g. --sizes 320 416")
+# Варианты пониженной точности рядом с каждой FP32-моделью: <name>_int8.onnx и <name>_fp16.onnx.
+# analytics.py берёт INT8 на CPU и FP16 на GPU (см. PROVIDER_PRECISIONS), если файл есть.
+parser.add_argument("--int8", metavar="FRAMES_DIR", help="also produce INT8 (QDQ) models calibrated on the images in FRAMES_DIR")
+parser.add_argument("--calibration-frames", type=int, default=200, help="max images used for INT8 calibration")
+parser.add_argument("--fp16", action="store_true", help="also produce FP16 models (float32 inputs/outputs kept)")
+parser.add_argument("--report", metavar="PATH", help="compare speed and detections of the variants against FP32, write JSON")
+parser.add_argument("--eval-dir", help="images for --report (default: the --int8 calibration folder)")
+parser.add_argument("--skip-export", action="store_true", help="reuse existing .onnx files instead of exporting from yolov8n.pt")
+args = parser.parse_args()
 
-# Экспортируем её в формат ONNX
-# opset=12 - хорошая версия для совместимости
-# simplify=True - оптимизирует граф модели
-model.export(format="onnx", opset=12, simplify=True)
+for size in args.sizes:
+    if size % 32 != 0:
+        parser.error(f"size {size} is not a multiple of 32")
+if args.report and not (args.eval_dir or args.int8):
+    parser.error("--report needs --eval-dir or --int8 with sample frames")
 
-print("Модель успешно экспортирована в 'yolov8n.onnx'")
\ No newline at end of file
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def list_images(folder, limit=None):
+    paths = sorted(p for p in glob.glob(os.path.join(folder, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise SystemExit(f"No images found in {folder}")
+    return paths[:limit] if limit else paths
+
+
+def model_input_size(model_path):
+    # Для моделей с динамическими H/W калибруем и сравниваем на стандартных 640x640
+    import onnx
+    dims = onnx.load(model_path, load_external_data=False).graph.input[0].type.tensor_type.shape.dim
+    height, width = dims[2].dim_value or 640, dims[3].dim_value or 640
+    return width, height
+
+
+def load_tensor(path, width, height):
+    import cv2
+    import numpy as np
+    from analytics import preprocess
+    tensor, ratio, pad = preprocess(cv2.imread(path), width, height)
+    return np.ascontiguousarray(tensor), ratio, pad
+
+
+def export_int8(model_path, frames_dir):
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                          quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    width, height = model_input_size(model_path)
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self, input_name, paths):
+            self.input_name = input_name
+            self.paths = iter(paths)
+
+        def get_next(self):
+            path = next(self.paths, None)
+            if path is None:
+                return None
+            return {self.input_name: load_tensor(path, width, height)[0]}
+
+    import onnx
+    input_name = onnx.load(model_path, load_external_data=False).graph.input[0].name
+    stem, ext = os.path.splitext(model_path)
+    prepared_path, output_path = f"{stem}_prep{ext}", f"{stem}_int8{ext}"
+    # Подготовка (shape inference, свёртка констант) заметно улучшает покрытие квантованием;
+    # символьный вывод форм нужен трансформерам, свёрточной сети хватает обычного
+    quant_pre_process(model_path, prepared_path, skip_symbolic_shape=True)
+    try:
+        # QDQ с поканальными весами: формат, который исполняют и CPU, и DirectML
+        quantize_static(prepared_path, output_path,
+                        FrameReader(input_name, list_images(frames_dir, args.calibration_frames)),
+                        quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        calibrate_method=CalibrationMethod.MinMax)
+    finally:
+        os.remove(prepared_path)
+    print(f"INT8-модель сохранена в '{output_path}'")
+
+
+def export_fp16(model_path):
+    import onnx
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+
+    stem, ext = os.path.splitext(model_path)
+    output_path = f"{stem}_fp16{ext}"
+    # Вход и выход остаются float32, чтобы analytics.py подавал тот же тензор
+    model = convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+    onnx.save(model, output_path)
+    print(f"FP16-модель сохранена в '{output_path}'")
+
+
+def match_detections(reference, candidate, iou_threshold=0.5):
+    """Greedy same-class IoU matching; returns the number of matched pairs."""
+    import numpy as np
+    from analytics import box_iou
+
+    def boxes(detections):
+        return np.stack([detections["x1"], detections["y1"], detections["x2"], detections["y2"]], axis=1)
+
+    matched = 0
+    for class_id in set(reference["class_id"].tolist()):
+        ref = reference[reference["class_id"] == class_id]
+        cand = candidate[candidate["class_id"] == class_id]
+        if not len(cand):
+            continue
+        ious = box_iou(boxes(ref), boxes(cand))
+        used = set()
+        for row in ious:
+            best = next((j for j in row.argsort()[::-1] if j not in used and row[j] >= iou_threshold), None)
+            if best is not None:
+                used.add(best)
+                matched += 1
+    return matched
+
+
+def compare_variants(model_path, eval_dir, report_path):
+    """Latency on CPU and detection agreement with the FP32 model for every variant next to it."""
+    import numpy as np
+    import onnxruntime as ort
+    from analytics import Postprocessor, run_inference
+
+    stem, ext = os.path.splitext(model_path)
+    variants = {name: path for name, path in
+                (("fp32", model_path), ("int8", f"{stem}_int8{ext}"), ("fp16", f"{stem}_fp16{ext}"))
+                if os.path.exists(path)}
+    width, height = model_input_size(model_path)
+    frames = [load_tensor(path, width, height) for path in list_images(eval_dir)]
+    postprocessor = Postprocessor()
+
+    detections, results = {}, {}
+    for name, path in variants.items():
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        input_name, output_name = session.get_inputs()[0].name, session.get_outputs()[0].name
+        run_inference(session, input_name, output_name, frames[0][0])
+        latencies, detections[name] = [], []
+        for tensor, ratio, pad in frames:
+            started = time.perf_counter()
+            output = run_inference(session, input_name, output_name, tensor)
+            latencies.append((time.perf_counter() - started) * 1000.0)
+            detections[name].append(postprocessor(output, ratio, pad))
+        results[name] = {
+            "file": os.path.basename(path),
+            "size_mb": round(os.path.getsize(path) / (1024 * 1024), 2),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p90_ms": round(float(np.percentile(latencies, 90)), 2),
+        }
+
+    baseline = results["fp32"]["p50_ms"]
+    for name, result in results.items():
+        matched = sum(match_detections(ref, cand) for ref, cand in zip(detections["fp32"], detections[name]))
+        reference_count = sum(len(d) for d in detections["fp32"])
+        candidate_count = sum(len(d) for d in detections[name])
+        # Эталон — детекции FP32: разметки нет, поэтому меряем согласие, а не mAP
+        precision = matched / candidate_count if candidate_count else 1.0
+        recall = matched / reference_count if reference_count else 1.0
+        result.update({
+            "speedup": round(baseline / result["p50_ms"], 2) if result["p50_ms"] else None,
+            "detections": candidate_count,
+            "precision_vs_fp32": round(precision, 3),
+            "recall_vs_fp32": round(recall, 3),
+            "f1_vs_fp32": round(2 * precision * recall / (precision + recall), 3) if precision + recall else 0.0,
+        })
+
+    report = {"model": os.path.basename(model_path), "frames": len(frames), "provider": "CPUExecutionProvider",
+              "input": f"{width}x{height}", "onnxruntime": ort.__version__, "variants": results}
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"{'variant':<8}{'p50 ms':>10}{'speedup':>10}{'size MB':>10}{'F1 vs fp32':>12}")
+    for name, result in results.items():
+        print(f"{name:<8}{result['p50_ms']:>10}{result['speedup']:>10}{result['size_mb']:>10}{result['f1_vs_fp32']:>12}")
+    print(f"Отчёт сохранён в '{report_path}'")
+
+
+exported = [f"yolov8n_{size}.onnx" for size in args.sizes] + ["yolov8n.onnx"]
+
+if not args.skip_export:
+    from ultralytics import YOLO
+
+    # Загружаем стандартную модель YOLOv8n
+    model = YOLO("yolov8n.pt")
+
+    for size in args.sizes:
+        exported_path = model.export(format="onnx", opset=12, simplify=True, imgsz=size, dynamic=False)
+        os.replace(exported_path, f"yolov8n_{size}.onnx")
+        print(f"Модель успешно экспортирована в 'yolov8n_{size}.onnx'")
+
+    # Экспортируем её в формат ONNX
+    # opset=12 - хорошая версия для совместимости
+    # simplify=True - оптимизирует граф модели
+    # dynamic=True - динамические оси batch/height/width
+    model.export(format="onnx", opset=12, simplify=True, dynamic=not args.static)
+
+    print("Модель успешно экспортирована в 'yolov8n.onnx'")
+
+for model_path in exported:
+    if args.int8:
+        export_int8(model_path, args.int8)
+    if args.fp16:
+        export_fp16(model_path)
+
+if args.report:
+    compare_variants("yolov8n.onnx", args.eval_dir or args.int8, args.report)
@@ -6,12 +6,10 @@ const fs = require('fs');
 const fsPromises = fs.promises;
 const os = require('os');
 const { exec } = require('child_process');
-const { Mutex } = require('async-mutex');
 
 // Зависимости от других наших модулей
 const authManager = require('./auth-manager');
 
-const eventsMutex = new Mutex();
 let appSettingsCache = null;
 
 // --- Управление путями ---
@@ -150,47 +148,111 @@ async function initializeUsers() {
 
 // --- События аналитики и записи ---
 
-async function saveAnalyticsEvent(eventData) {
-    const release = await eventsMutex.acquire();
-    try {
-        let allEvents = {};
+// Журнал событий пишет analytics.py (DetectionStore): events/<дата UTC>/<cameraId>.jsonl
+// и сайдкар-индекс <cameraId>.idx.json. events.json — только старые события, он больше не пишется.
+const eventsStorePath = path.join(dataPathRoot, 'events');
+let legacyEventsCache = null;
+
+function getEventsStorePath() {
+    return eventsStorePath;
+}
+
+async function readLegacyEvents() {
+    if (!legacyEventsCache) {
         try {
-            const data = await fsPromises.readFile(eventsPath, 'utf-8');
-            allEvents = JSON.parse(data);
+            legacyEventsCache = JSON.parse(await fsPromises.readFile(eventsPath, 'utf-8'));
         } catch (e) {
             if (e.code !== 'ENOENT') console.error('[Events] Error reading events file:', e);
+            legacyEventsCache = {};
         }
+    }
+    return legacyEventsCache;
+}
 
-        const eventTimestamp = new Date(eventData.timestamp * 1000);
-        const dateKey = eventTimestamp.toISOString().split('T')[0];
-        
-        if (!allEvents[dateKey]) {
-            allEvents[dateKey] = [];
+/**
+ * Читает события одного сегмента журнала с фильтром по времени и меткам.
+ * Индекс позволяет пропустить сегмент без нужных меток и начать чтение с минуты `from`.
+ */
+async function readEventSegment(segmentPath, date, { from, to, labels }) {
+    let index = null;
+    try {
+        index = JSON.parse(await fsPromises.readFile(segmentPath.replace(/\.jsonl$/, '.idx.json'), 'utf-8'));
+    } catch (e) { /* Индекса нет — читаем сегмент целиком */ }
+    const { size } = await fsPromises.stat(segmentPath);
+    // Индекс описывает сегмент целиком, только если сегмент не дописан после его сохранения
+    if (index && index.bytes === size) {
+        if (labels && !labels.some(label => index.labels[label])) return [];
+        if ((from != null && index.last < from) || (to != null && index.first > to)) return [];
+    }
+    let start = 0;
+    if (index && from != null) {
+        const minute = Math.floor((from - Date.parse(`${date}T00:00:00Z`) / 1000) / 60);
+        for (const [indexMinute, offset] of index.minutes) {
+            if (indexMinute > minute) break;
+            start = offset;
         }
-
-        allEvents[dateKey].push({
-            cameraId: eventData.cameraId,
-            timestamp: eventData.timestamp,
-            objects: [...new Set(eventData.objects.map(obj => obj.label))],
-        });
-
-        await fsPromises.writeFile(eventsPath, JSON.stringify(allEvents, null, 2));
-    } catch (e) {
-        console.error('[Events] Failed to save analytics event:', e);
+    }
+    const buffer = Buffer.alloc(size - start);
+    const handle = await fsPromises.open(segmentPath, 'r');
+    try {
+        await handle.read(buffer, 0, buffer.length, start);
     } finally {
-        release();
+        await handle.close();
+    }
+    const events = [];
+    for (const line of buffer.toString('utf-8').split('\n')) {
+        if (!line) continue;
+        let event;
+        try { event = JSON.parse(line); } catch (e) { continue; } // строка, оборванная сбоем
+        if (from != null && event.t < from) continue;
+        if (to != null && event.t > to) continue;
+        if (labels && !event.labels.some(label => labels.includes(label))) continue;
+        events.push(event);
     }
+    return events;
 }
 
-async function getEventsForDate({ date }) {
+/**
+ * События аналитики за дату (UTC, как ключи events.json) с необязательными фильтрами.
+ * @param {{ date: string, cameraId?: number, from?: number, to?: number, labels?: string[] }} query
+ *   from/to — секунды Unix, labels — событие подходит, если в нём есть хотя бы одна метка.
+ * @returns {Promise<Array<{cameraId: number, timestamp: number, objects: string[], snapshot?: string}>>}
+ */
+async function queryEvents({ date, cameraId, from, to, labels }) {
+    const wanted = labels && labels.length > 0 ? labels : null;
+    const results = [];
+
+    let files = [];
     try {
-        const data = await fsPromises.readFile(eventsPath, 'utf-8');
-        const allEvents = JSON.parse(data);
-        return allEvents[date] || [];
-    } catch (e) {
-        if (e.code !== 'ENOENT') console.error('[Events] Error reading events for date:', e);
-        return [];
+        files = (await fsPromises.readdir(path.join(eventsStorePath, date))).filter(file => file.endsWith('.jsonl'));
+    } catch (e) { /* За эту дату журнала нет */ }
+    for (const file of files) {
+        if (cameraId != null && file !== `${cameraId}.jsonl`) continue;
+        const events = await readEventSegment(path.join(eventsStorePath, date, file), date, { from, to, labels: wanted });
+        for (const event of events) {
+            results.push({
+                cameraId: event.camera,
+                timestamp: event.t,
+                objects: event.labels,
+                ...(event.snapshot && { snapshot: event.snapshot }),
+            });
+        }
     }
+
+    // events.json читается только за даты, по которым журнала ещё нет (до перехода на DetectionStore)
+    if (files.length > 0) return results.sort((a, b) => a.timestamp - b.timestamp);
+    const legacy = (await readLegacyEvents())[date] || [];
+    results.push(...legacy.filter(event =>
+        (cameraId == null || event.cameraId === cameraId) &&
+        (from == null || event.timestamp >= from) &&
+        (to == null || event.timestamp <= to) &&
+        (!wanted || event.objects.some(label => wanted.includes(label)))
+    ));
+    return results.sort((a, b) => a.timestamp - b.timestamp);
+}
+
+async function getEventsForDate({ date, cameraId }) {
+    return queryEvents({ date, cameraId });
 }
 
 async function getRecordingsForDate({ cameraName, date }) {
@@ -231,6 +293,31 @@ async function getRecordingsForDate({ cameraName, date }) {
     }
 }
 
+async function getArchiveDetections({ cameraName, date, labels }) {
+    const settings = await getAppSettings();
+    const recordings = await getRecordingsForDate({ cameraName, date });
+    const wanted = labels && labels.length > 0 ? new Set(labels) : null;
+    const results = [];
+
+    for (const recording of recordings) {
+        let index;
+        try {
+            const indexPath = path.join(settings.recordingsPath, `${recording.name}.detections.json`);
+            index = JSON.parse(await fsPromises.readFile(indexPath, 'utf-8'));
+        } catch (e) {
+            continue; // запись ещё не проанализирована
+        }
+        const segments = Object.entries(index.segments || {})
+            .filter(([label]) => !wanted || wanted.has(label))
+            .flatMap(([label, intervals]) => intervals.map(([start, end]) => ({ label, start, end })))
+            .sort((a, b) => a.start - b.start);
+        if (segments.length > 0) {
+            results.push({ name: recording.name, startTimeString: recording.startTimeString, duration: index.duration, segments });
+        }
+    }
+    return results;
+}
+
 async function getDatesWithActivity(cameraName) {
     const activeDates = new Set();
     const settings = await getAppSettings();
@@ -246,10 +333,11 @@ async function getDatesWithActivity(cameraName) {
         });
     } catch (e) { /* Игнорируем, если папки нет */ }
 
+    Object.keys(await readLegacyEvents()).forEach(dateKey => activeDates.add(dateKey));
     try {
-        const eventsData = await fsPromises.readFile(eventsPath, 'utf-8');
-        Object.keys(JSON.parse(eventsData)).forEach(dateKey => activeDates.add(dateKey));
-    } catch (e) { /* Игнорируем, если файла нет */ }
+        const dates = await fsPromises.readdir(eventsStorePath);
+        dates.filter(name => /^\d{4}-\d{2}-\d{2}$/.test(name)).forEach(dateKey => activeDates.add(dateKey));
+    } catch (e) { /* Журнала ещё нет */ }
     
     return Array.from(activeDates);
 }
@@ -365,9 +453,11 @@ module.exports = {
     saveConfiguration,
     getCameraConfig,
     initializeUsers,
-    saveAnalyticsEvent,
+    getEventsStorePath,
+    queryEvents,
     getEventsForDate,
     getRecordingsForDate,
+    getArchiveDetections,
     getDatesWithActivity,
     exportConfig,
     importConfig,
@@ -11,13 +11,22 @@ class FfmpegCommandBuilder {
         this.settings = appSettings;
     }
 
+    /**
+     * Путь к исполняемому файлу ffmpeg.
+     * @returns {string}
+     */
+    get command() {
+        return ffmpegPath;
+    }
+
     /**
      * Формирует аргументы для запуска стриминга в JSMpeg.
      * @param {object} credentials - Полные данные камеры, включая пароль.
      * @param {number} streamId - ID потока (0 для HD, 1 для SD).
+     * @param {{ width: number, fps: number }|null} ingest - Второй выход для аналитики (см. IngestTap).
      * @returns {{ command: string, args: string[] }}
      */
-    buildForStream(credentials, streamId) {
+    buildForStream(credentials, streamId, ingest = null) {
         const streamPath = streamId === 0 ? (credentials.streamPath0 || '/stream0') : (credentials.streamPath1 || '/stream1');
         const streamUrl = this.buildRtspUrl(credentials, streamPath);
         
@@ -46,6 +55,19 @@ class FfmpegCommandBuilder {
             '-' // Вывод в stdout
         ];
 
+        if (ingest) {
+            // Уменьшенные кадры для аналитики из того же декодера: камера отдаёт один поток.
+            // fps стоит перед scale, чтобы масштабировались только нужные кадры
+            const download = (this.settings.hwAccel === 'intel') ? 'hwdownload,format=nv12,' : '';
+            args.push(
+                '-map', '0:v:0',
+                '-an',
+                '-vf', `${download}fps=${ingest.fps},scale=w='min(${ingest.width},iw)':h=-2,format=yuv420p`,
+                '-f', 'yuv4mpegpipe',
+                'pipe:3'
+            );
+        }
+
         return { command: ffmpegPath, args };
     }
 
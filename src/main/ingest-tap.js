@@ -0,0 +1,88 @@
+// --- ФАЙЛ: src/main/ingest-tap.js (НОВЫЙ) ---
+
+const fs = require('fs');
+const net = require('net');
+
+const Y4M_FRAME_MARKER = Buffer.from('FRAME');
+
+/**
+ * Раздаёт аналитике кадры живого просмотра (общий приём, analytics_shared_ingest).
+ *
+ * ffmpeg живого просмотра пишет второй выход — уменьшенный YUV4MPEG — в pipe:3.
+ * IngestTap разбирает поток на целые кадры и пересылает их клиентам локального
+ * сокета (именованного канала в Windows). Поток читается всегда, чтобы не тормозить
+ * ffmpeg; если клиент не успевает, кадр для него пропускается целиком.
+ */
+class IngestTap {
+    /**
+     * @param {string} ipcPath - Путь сокета или имя канала, к которому подключается analytics.py.
+     */
+    constructor(ipcPath) {
+        this.ipcPath = ipcPath;
+        this.server = null;
+        this.clients = new Set();
+        this.header = null;    // Первая строка потока (YUV4MPEG2 W.. H.. ...)
+        this.frameSize = 0;    // Байт в кадре yuv420p
+        this.chunks = [];
+        this.buffered = 0;
+    }
+
+    listen() {
+        return new Promise((resolve, reject) => {
+            if (process.platform !== 'win32' && fs.existsSync(this.ipcPath)) fs.unlinkSync(this.ipcPath);
+            this.server = net.createServer(socket => {
+                socket.on('error', () => this.clients.delete(socket));
+                socket.on('close', () => this.clients.delete(socket));
+                if (this.header) socket.write(this.header);
+                this.clients.add(socket);
+            });
+            this.server.once('error', reject);
+            this.server.listen(this.ipcPath, () => resolve(this));
+        });
+    }
+
+    /**
+     * Принимает очередной кусок вывода ffmpeg.
+     * @param {Buffer} chunk
+     */
+    write(chunk) {
+        this.chunks.push(chunk);
+        this.buffered += chunk.length;
+        // Пока не пришёл целый кадр, куски не склеиваем
+        if (this.header && this.buffered < this.frameSize + Y4M_FRAME_MARKER.length + 1) return;
+        let data = Buffer.concat(this.chunks, this.buffered);
+        for (;;) {
+            const lineEnd = data.indexOf(0x0a);
+            if (lineEnd === -1) break;
+            if (!this.header) {
+                this.header = Buffer.from(data.subarray(0, lineEnd + 1));
+                const params = Object.fromEntries(this.header.toString().trim().split(' ').slice(1).map(t => [t[0], t.slice(1)]));
+                this.frameSize = Number(params.W) * Number(params.H) * 3 / 2;
+                this.clients.forEach(socket => socket.write(this.header));
+                data = data.subarray(lineEnd + 1);
+                continue;
+            }
+            const total = lineEnd + 1 + this.frameSize;
+            if (data.length < total) break;
+            if (data.subarray(0, Y4M_FRAME_MARKER.length).equals(Y4M_FRAME_MARKER)) {
+                const frame = data.subarray(0, total);
+                for (const socket of this.clients) {
+                    // Больше двух кадров в очереди — аналитика отстаёт, этот кадр ей не нужен
+                    if (socket.writableLength < this.frameSize * 2) socket.write(frame);
+                }
+            }
+            data = data.subarray(total);
+        }
+        // Копия остатка: иначе он держал бы весь склеенный буфер
+        this.chunks = data.length ? [Buffer.from(data)] : [];
+        this.buffered = data.length;
+    }
+
+    close() {
+        this.clients.forEach(socket => socket.destroy());
+        this.clients.clear();
+        if (this.server) this.server.close();
+    }
+}
+
+module.exports = IngestTap;
@@ -81,6 +81,8 @@ function registerIpcHandlers() {
 
     // --- Video Analytics ---
     ipcMain.handle('toggle-analytics', withErrorHandling((event, cameraId) => processManager.toggleAnalytics(cameraId, getMainWindow()), 'toggleAnalytics'));
+    ipcMain.handle('update-analytics-config', withErrorHandling((event, { cameraId, analyticsConfig }) => processManager.updateAnalyticsConfig(cameraId, analyticsConfig), 'updateAnalyticsConfig'));
+    ipcMain.handle('set-analytics-overlay', withErrorHandling((event, { cameraId, visible }) => processManager.setAnalyticsOverlay(cameraId, visible), 'setAnalyticsOverlay'));
     
     // --- Recording & Archive ---
     ipcMain.handle('start-recording', withErrorHandling((event, camera) => processManager.startRecording(camera, getMainWindow()), 'startRecording'));
@@ -91,7 +93,10 @@ function registerIpcHandlers() {
     }, 'openRecordingsFolder'));
     ipcMain.handle('get-recordings-for-date', withErrorHandling((event, data) => configManager.getRecordingsForDate(data), 'getRecordingsForDate'));
     ipcMain.handle('export-archive-clip', withErrorHandling((event, data) => processManager.exportArchiveClip(data, getMainWindow()), 'exportArchiveClip'));
+    ipcMain.handle('analyze-archive', withErrorHandling((event, data) => processManager.analyzeArchive(data, getMainWindow()), 'analyzeArchive'));
+    ipcMain.handle('get-archive-detections', withErrorHandling((event, data) => configManager.getArchiveDetections(data), 'getArchiveDetections'));
     ipcMain.handle('get-events-for-date', withErrorHandling((event, data) => configManager.getEventsForDate(data), 'getEventsForDate'));
+    ipcMain.handle('query-events', withErrorHandling((event, data) => configManager.queryEvents(data), 'queryEvents'));
     ipcMain.handle('get-dates-with-activity', withErrorHandling((event, cameraName) => configManager.getDatesWithActivity(cameraName), 'getDatesWithActivity'));
 
     // --- System & Events ---
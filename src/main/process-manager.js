@@ -5,6 +5,7 @@ const path = require('path');
 const fs = require('fs');
 const fsPromises = require('fs').promises;
 const net = require('net');
+const os = require('os');
 const WebSocket = require('ws');
 const { Mutex } = require('async-mutex');
 const { app, dialog } = require('electron');
@@ -15,6 +16,7 @@ const configManager = require('./config-manager');
 const authManager = require('./auth-manager');
 const services = require('./services');
 const FfmpegCommandBuilder = require('./ffmpeg-builder');
+const IngestTap = require('./ingest-tap');
 
 let gpuInfoCache = null;
 
@@ -36,6 +38,8 @@ const PROCESS_TYPES = { STREAM: 'stream', RECORDING: 'recording', ANALYTICS: 'an
 const processes = new Map();
 const streamManager = {};
 const recordingManager = {};
+const ingestTaps = {}; // cameraId -> IngestTap (общий приём для аналитики)
+const overlayCameras = new Set(); // Камеры с открытым живым просмотром: им нужны рамки 'overlay'
 const recordingStopTimers = {};
 
 const buildProcessId = (type, id) => `${type}-${id}`;
@@ -148,12 +152,42 @@ async function startVideoStream({ credentials, streamId }) {
     
     const settings = await configManager.getAppSettings();
     const builder = new FfmpegCommandBuilder(settings);
-    const { command, args: ffmpegArgs } = builder.buildForStream(fullCredentials, streamId);
+    // Общий приём: этот же ffmpeg отдаёт уменьшенные кадры аналитике камеры, и та не
+    // открывает к камере второе RTSP-подключение. Отвод один на камеру — от первого потока,
+    // и только если аналитика камеры включена или уже работает: иначе второй выход не нужен.
+    const analyticsWanted = cameraConfig.analyticsConfig?.enabled || analyticsServer?.cameras.has(credentials.id);
+    let ingest = null;
+    if (settings.analytics_shared_ingest && analyticsWanted && !ingestTaps[credentials.id]) {
+        const liveFps = settings.fps || 20;
+        ingest = {
+            width: settings.analytics_ingest_width || 640,
+            // С целевым FPS аналитики лишние кадры не масштабируем; без него FrameScheduler
+            // прореживает по frame_skip, как при собственном подключении
+            fps: settings.analytics_target_fps ? Math.min(liveFps, settings.analytics_target_fps * 2) : liveFps,
+        };
+    }
+    const { command, args: ffmpegArgs } = builder.buildForStream(fullCredentials, streamId, ingest);
 
     console.log(`[FFMPEG] Starting stream ${uniqueStreamIdentifier} with command:`, command, ffmpegArgs.join(' '));
-    const ffmpegProcess = spawn(command, ffmpegArgs, { detached: false, windowsHide: true });
+    const ffmpegProcess = spawn(command, ffmpegArgs, {
+        detached: false,
+        windowsHide: true,
+        stdio: ingest ? ['pipe', 'pipe', 'pipe', 'pipe'] : 'pipe',
+    });
     
     addProcess(uniqueStreamIdentifier, ffmpegProcess, PROCESS_TYPES.STREAM);
+
+    let tap = null;
+    if (ingest) {
+        tap = ingestTaps[credentials.id] = new IngestTap(getIngestIpcPath(credentials.id));
+        ffmpegProcess.stdio[3].on('data', (chunk) => tap.write(chunk));
+        tap.listen().then(() => {
+            // Уже работающая аналитика переключается с камеры на кадры живого просмотра
+            if (analyticsServer && analyticsServer.cameras.has(credentials.id)) {
+                sendAnalyticsCommand({ cmd: 'update_config', camera_id: credentials.id, config: { ingest_path: tap.ipcPath } });
+            }
+        }).catch((err) => console.error(`[Ingest] Cannot listen on ${tap.ipcPath}: ${err.message}`));
+    }
     
     ffmpegProcess.stdout.on('data', (data) => wss.clients.forEach(c => c.readyState === WebSocket.OPEN && c.send(data)));
     
@@ -189,6 +223,11 @@ async function startVideoStream({ credentials, streamId }) {
             releasePort(wsPort); 
             delete streamManager[uniqueStreamIdentifier]; 
         }
+        // Аналитика увидит конец потока и вернётся к собственному подключению к камере
+        if (tap) {
+            tap.close();
+            if (ingestTaps[credentials.id] === tap) delete ingestTaps[credentials.id];
+        }
         
         stopProcess(uniqueStreamIdentifier);
         const mainWindow = require('./window-manager').getMainWindow();
@@ -290,6 +329,54 @@ async function exportArchiveClip({ sourceFilename, startTime, duration }, mainWi
     });
 }
 
+// --- Анализ архива: analytics --analyze-files по записям камеры за день ---
+// Рядом с каждой записью появляется <запись>.detections.json (см. configManager.getArchiveDetections)
+
+let archiveAnalysisProcess = null;
+
+async function analyzeArchive({ cameraName, date }, mainWindow) {
+    if (archiveAnalysisProcess) return { success: false, error: 'Archive analysis is already running' };
+
+    const analyticsPath = getAnalyticsExecutablePath();
+    if (!fs.existsSync(analyticsPath)) {
+        return { success: false, error: `Analytics executable not found: ${analyticsPath}` };
+    }
+    const settings = await configManager.getAppSettings();
+    const recordings = await configManager.getRecordingsForDate({ cameraName, date });
+    if (recordings.length === 0) return { success: false, error: 'No recordings for this date' };
+
+    const config = {
+        resize_width: settings.analytics_resize_width || 416,
+        target_fps: settings.analytics_archive_fps || 2,
+        // Живая аналитика продолжает работать — архиву отдаём часть ядер
+        jobs: settings.analytics_archive_jobs || Math.max(1, Math.floor(os.cpus().length / 4)),
+        model_cache_dir: path.join(app.getPath('userData'), 'analytics-cache'),
+        model_precision: settings.analytics_model_precision || 'auto',
+    };
+    const configArg = Buffer.from(JSON.stringify(config)).toString('base64');
+    const files = recordings.map(r => path.join(settings.recordingsPath, r.name));
+
+    return new Promise((resolve) => {
+        const analysisProcess = spawn(analyticsPath,
+            ['--analyze-files', settings.analytics_provider || 'auto', configArg, ...files], { windowsHide: true });
+        archiveAnalysisProcess = analysisProcess;
+        let summary = null;
+
+        analysisProcess.stdout.on('data', createLineReader((result) => {
+            if (result.status === 'analysis_done') summary = result;
+            if (mainWindow && !mainWindow.isDestroyed()) {
+                mainWindow.webContents.send('archive-analysis-progress', { cameraName, date, result });
+            }
+        }));
+        analysisProcess.stderr.on('data', (data) => console.error(`[Archive Analysis] ${data.toString().trim()}`));
+        analysisProcess.on('close', (code) => {
+            archiveAnalysisProcess = null;
+            if (code === 0 && summary) resolve({ success: true, ...summary });
+            else resolve({ success: false, error: `Archive analysis failed with code ${code}` });
+        });
+    });
+}
+
 async function handleAnalyticsDetection(cameraId, camera) {
     const settings = await configManager.getAppSettings();
     const autoStopDelay = (settings.analytics_record_duration || 30) * 1000;
@@ -323,20 +410,257 @@ function getAnalyticsExecutablePath() {
         console.log(`[Analytics] ${platform} system detected. Selecting CPU executable.`);
     }
 
+    const baseName = exeName;
     if (platform === 'win32') {
         exeName += '.exe';
     }
     
-    return app.isPackaged
-        ? path.join(process.resourcesPath, 'analytics', exeName)
-        : path.join(__dirname, '../../extra/analytics', exeName);
+    const analyticsDir = app.isPackaged
+        ? path.join(process.resourcesPath, 'analytics')
+        : path.join(__dirname, '../../extra/analytics');
+    // Сборка build_analytics.py --onedir стартует быстрее: не распаковывается при каждом запуске
+    const onedirPath = path.join(analyticsDir, 'onedir', baseName, exeName);
+    return fs.existsSync(onedirPath) ? onedirPath : path.join(analyticsDir, exeName);
+}
+
+// --- Сервер аналитики: один процесс и одна ONNX-сессия на все камеры ---
+
+const ANALYTICS_SERVER_ID = buildProcessId(PROCESS_TYPES.ANALYTICS, 'server');
+let analyticsServer = null; // { process, cameras: Map<cameraId, camera> }
+let analyticsServerStarting = null; // Promise запуска, пока он идёт
+
+function sendAnalyticsCommand(command) {
+    if (!analyticsServer || !analyticsServer.process.stdin.writable) return false;
+    analyticsServer.process.stdin.write(JSON.stringify(command) + '\n');
+    return true;
+}
+
+async function handleAnalyticsResult(cameraId, result, mainWindow) {
+    const camera = analyticsServer?.cameras.get(cameraId);
+    if (!camera) return;
+    if (result.status === 'objects_detected' && result.objects.length > 0) {
+        // С трекером уведомляем только о появлении новых объектов; периодические 'updated'
+        // лишь продлевают запись. Сами события сохраняет analytics.py (events_dir)
+        const newObjects = result.objects.filter(o => !o.event || o.event === 'appeared');
+        if (newObjects.length > 0) {
+            const labels = [...new Set(newObjects.map(o => o.label))];
+            services.showAnalyticsNotification(camera.name, cameraId, labels);
+        }
+        await handleAnalyticsDetection(cameraId, camera);
+    }
+    if (result.status === 'preroll_saved') {
+        console.log(`[Analytics] Pre-roll clip for camera ${cameraId} saved: ${result.path}`);
+    }
+    if (mainWindow && !mainWindow.isDestroyed()) {
+        // Служебная статистика не должна сбрасывать оверлей с рамками на видео
+        let channel = 'analytics-stats';
+        if (result.status === 'info') channel = 'analytics-provider-info';
+        else if (['objects_detected', 'overlay', 'error'].includes(result.status)) channel = 'analytics-update';
+        mainWindow.webContents.send(channel, { cameraId, result });
+    }
+}
+
+// --- Бинарный протокол аналитики (см. BinaryChannel в analytics.py) ---
+
+const ANALYTICS_FRAME_JSON = 1;
+const ANALYTICS_FRAME_DETECTIONS = 2;
+const ANALYTICS_DETECTIONS_HEADER_SIZE = 24;
+const ANALYTICS_DETECTION_RECORD_SIZE = 26;
+const ANALYTICS_TRACK_EVENTS = [undefined, 'appeared', 'updated', 'disappeared'];
+const ANALYTICS_DETECTION_KINDS = ['objects_detected', 'objects_lost', 'overlay'];
+
+function createLineReader(onMessage) {
+    let pending = '';
+    return (data) => {
+        pending += data.toString();
+        const lines = pending.split('\n');
+        pending = lines.pop();
+        lines.filter(Boolean).forEach(line => {
+            try {
+                onMessage(JSON.parse(line));
+            } catch (e) {
+                console.warn('[Analytics] Non-JSON output from analytics server:', line);
+            }
+        });
+    };
+}
+
+function createBinaryFrameReader(onMessage, getLabels) {
+    let pending = Buffer.alloc(0);
+    return (chunk) => {
+        pending = pending.length ? Buffer.concat([pending, chunk]) : chunk;
+        let offset = 0;
+        while (pending.length - offset >= 4) {
+            const length = pending.readUInt32LE(offset);
+            if (pending.length - offset - 4 < length) break;
+            const frame = pending.subarray(offset + 4, offset + 4 + length);
+            offset += 4 + length;
+            try {
+                onMessage(decodeAnalyticsFrame(frame, getLabels()));
+            } catch (e) {
+                console.warn(`[Analytics] Failed to decode analytics frame: ${e.message}`);
+            }
+        }
+        pending = pending.subarray(offset);
+    };
+}
+
+function decodeAnalyticsFrame(frame, labels) {
+    const type = frame.readUInt8(0);
+    if (type === ANALYTICS_FRAME_JSON) {
+        return JSON.parse(frame.toString('utf8', 1));
+    }
+    if (type !== ANALYTICS_FRAME_DETECTIONS) {
+        throw new Error(`Unknown frame type ${type}`);
+    }
+    const kind = frame.readUInt8(1);
+    const cameraId = Number(frame.readBigInt64LE(2));
+    const count = frame.readUInt16LE(22);
+    const objects = [];
+    for (let i = 0; i < count; i++) {
+        const offset = ANALYTICS_DETECTIONS_HEADER_SIZE + i * ANALYTICS_DETECTION_RECORD_SIZE;
+        const classId = frame.readUInt8(offset);
+        const event = ANALYTICS_TRACK_EVENTS[frame.readUInt8(offset + 1)];
+        const object = {
+            label: labels[classId] || String(classId),
+            confidence: frame.readFloatLE(offset + 6),
+            box: {
+                x: frame.readInt32LE(offset + 10), y: frame.readInt32LE(offset + 14),
+                w: frame.readInt32LE(offset + 18), h: frame.readInt32LE(offset + 22),
+            },
+        };
+        if (event) {
+            object.event = event;
+            object.track_id = frame.readUInt32LE(offset + 2);
+        }
+        objects.push(object);
+    }
+    return {
+        status: ANALYTICS_DETECTION_KINDS[kind] || 'objects_detected',
+        cameraId: cameraId === -1 ? undefined : cameraId,
+        timestamp: frame.readDoubleLE(10),
+        frame: { w: frame.readUInt16LE(18), h: frame.readUInt16LE(20) },
+        objects,
+    };
+}
+
+function getLocalIpcPath(name) {
+    return process.platform === 'win32' ? `\\\\.\\pipe\\${name}` : path.join(os.tmpdir(), `${name}.sock`);
+}
+
+function getAnalyticsIpcPath() {
+    return getLocalIpcPath(`openipc-analytics-${process.pid}`);
+}
+
+function getIngestIpcPath(cameraId) {
+    return getLocalIpcPath(`openipc-ingest-${process.pid}-${cameraId}`);
+}
+
+function listenForAnalyticsIpc(ipcPath, onData) {
+    return new Promise((resolve, reject) => {
+        if (process.platform !== 'win32' && fs.existsSync(ipcPath)) fs.unlinkSync(ipcPath);
+        const ipcServer = net.createServer(socket => socket.on('data', onData));
+        ipcServer.once('error', reject);
+        ipcServer.listen(ipcPath, () => resolve(ipcServer));
+    });
+}
+
+async function startAnalyticsServer(analyticsPath, settings, mainWindow) {
+    const providerChoice = settings.analytics_provider || 'auto';
+    const binaryProtocol = settings.analytics_ipc_protocol === 'binary';
+    const serverConfig = {
+        max_batch_size: settings.analytics_max_batch_size || 8,
+        max_batch_delay_ms: settings.analytics_max_batch_delay_ms || 20,
+        resize_width: settings.analytics_resize_width || 416,
+        protocol: binaryProtocol ? 'binary' : 'json',
+        flush_interval_ms: settings.analytics_ipc_flush_interval_ms || 50,
+        model_cache_dir: path.join(app.getPath('userData'), 'analytics-cache'),
+        model_precision: settings.analytics_model_precision || 'auto',
+        // Потоки ORT и разбиение ядер: workers > 1 запускает супервизор с N процессами инференса
+        workers: settings.analytics_workers || 1,
+        intra_op_threads: settings.analytics_intra_op_threads || null,
+        inter_op_threads: settings.analytics_inter_op_threads || null,
+        execution_mode: settings.analytics_execution_mode || null,
+        cpu_affinity: settings.analytics_cpu_affinity || null,
+    };
+    const server = { process: null, ipcServer: null, cameras: new Map(), labels: [] };
+
+    const onMessage = async (result) => {
+        if (result.status === 'ready') {
+            if (result.labels) server.labels = result.labels;
+            console.log(`[Analytics] Server ready in ${result.time_to_ready_ms} ms`);
+        }
+        // Сообщения без cameraId (провайдер, фатальные ошибки) относятся ко всем камерам сервера
+        const targets = result.cameraId !== undefined ? [result.cameraId] : Array.from(server.cameras.keys());
+        for (const cameraId of targets) {
+            await handleAnalyticsResult(cameraId, result, mainWindow);
+        }
+    };
+    const binaryReader = binaryProtocol ? createBinaryFrameReader(onMessage, () => server.labels) : null;
+
+    if (binaryProtocol && settings.analytics_ipc_socket) {
+        serverConfig.ipc_path = getAnalyticsIpcPath();
+        server.ipcServer = await listenForAnalyticsIpc(serverConfig.ipc_path, binaryReader);
+    }
+
+    const serverConfigArg = Buffer.from(JSON.stringify(serverConfig)).toString('base64');
+    console.log(`[Analytics] Starting analytics server with provider choice: ${providerChoice}, protocol: ${serverConfig.protocol}`);
+    const analyticsProcess = spawn(analyticsPath, ['--server', providerChoice, serverConfigArg], { windowsHide: true });
+    server.process = analyticsProcess;
+    addProcess(ANALYTICS_SERVER_ID, analyticsProcess, PROCESS_TYPES.ANALYTICS);
+
+    // При выводе через сокет stdout остаётся текстовым (ошибки до открытия канала); рамки
+    // 'overlay' идут только бинарным каналом
+    const stdoutReader = binaryReader && !server.ipcServer ? binaryReader
+        : createLineReader(binaryReader ? (result) => result.status !== 'overlay' && onMessage(result) : onMessage);
+    analyticsProcess.stdout.on('data', stdoutReader);
+
+    analyticsProcess.stderr.on('data', (data) => {
+        console.error(`[Analytics STDERR] ${data.toString()}`);
+        if (mainWindow && !mainWindow.isDestroyed()) {
+            mainWindow.webContents.send('on-main-error', {
+                context: 'Analytics Server',
+                message: data.toString()
+            });
+        }
+    });
+
+    analyticsProcess.on('close', (code) => {
+        console.warn(`[Analytics] Analytics server exited with code ${code}.`);
+        if (server.ipcServer) server.ipcServer.close();
+        if (analyticsServer === server) analyticsServer = null;
+        // Запись в реестре могла уже занять новый сервер аналитики
+        if (getProcess(ANALYTICS_SERVER_ID)?.process === analyticsProcess) stopProcess(ANALYTICS_SERVER_ID);
+        for (const cameraId of server.cameras.keys()) {
+            if (recordingStopTimers[cameraId]) stopRecording(cameraId);
+            if (mainWindow && !mainWindow.isDestroyed()) {
+                mainWindow.webContents.send('analytics-status-change', { cameraId, active: false });
+            }
+        }
+        server.cameras.clear();
+    });
+
+    return server;
 }
 
 async function toggleAnalytics(cameraId, mainWindow) {
-    const analyticsId = buildProcessId(PROCESS_TYPES.ANALYTICS, cameraId);
-    if (getProcess(analyticsId)) {
-        stopProcess(analyticsId);
+    if (analyticsServer && analyticsServer.cameras.has(cameraId)) {
+        analyticsServer.cameras.delete(cameraId);
+        sendAnalyticsCommand({ cmd: 'remove_camera', camera_id: cameraId });
         if (recordingStopTimers[cameraId]) stopRecording(cameraId);
+        if (analyticsServer.cameras.size === 0) {
+            // Последняя камера отключена — освобождаем модель и память. Сервер сначала
+            // дописывает журнал событий, поэтому просим его выйти и добиваем только по таймауту
+            const server = analyticsServer;
+            sendAnalyticsCommand({ cmd: 'shutdown' });
+            analyticsServer = null;
+            setTimeout(() => {
+                if (getProcess(ANALYTICS_SERVER_ID)?.process === server.process) stopProcess(ANALYTICS_SERVER_ID);
+            }, 5000);
+        }
+        if (mainWindow && !mainWindow.isDestroyed()) {
+            mainWindow.webContents.send('analytics-status-change', { cameraId, active: false });
+        }
         return { success: true, status: 'stopped' };
     }
     
@@ -347,7 +671,10 @@ async function toggleAnalytics(cameraId, mainWindow) {
     const password = await authManager.getPasswordForCamera(camera.id);
     const fullCameraInfo = { ...camera, password };
     const builder = new FfmpegCommandBuilder(settings);
-    const rtspUrl = builder.buildRtspUrl(fullCameraInfo, fullCameraInfo.streamPath0 || '/stream0');
+    // Для аналитики достаточно SD-потока: он дешевле в декодировании
+    const useSubstream = settings.analytics_stream === 'sub';
+    const streamPath = useSubstream ? (fullCameraInfo.streamPath1 || '/stream1') : (fullCameraInfo.streamPath0 || '/stream0');
+    const rtspUrl = builder.buildRtspUrl(fullCameraInfo, streamPath);
     
     const analyticsPath = getAnalyticsExecutablePath();
     
@@ -361,56 +688,51 @@ async function toggleAnalytics(cameraId, mainWindow) {
         objects: camera.analyticsConfig?.objects || [],
         resize_width: settings.analytics_resize_width || 416,
         frame_skip: settings.analytics_frame_skip || 10,
+        target_fps: settings.analytics_target_fps || null,
+        capture_backend: settings.analytics_capture_backend || 'opencv',
+        keyframes_only: settings.analytics_keyframes_only || false,
+        ffmpeg_path: builder.command,
+        tracking: settings.analytics_tracking !== false,
+        // 'updated' продлевает запись по событию, поэтому приходит чаще, чем она успела бы остановиться
+        track_update_interval: Math.min(settings.analytics_track_update_interval || 10,
+            Math.max(1, (settings.analytics_record_duration || 30) / 2)),
+        roi: camera.analyticsConfig?.roi || null,
+        zones: camera.analyticsConfig?.zones || null,
+        // Предзапись (по желанию): клип с последними секундами до срабатывания ложится рядом
+        // с записями; стоит JPEG-кодирования кадров в потоке захвата, поэтому по умолчанию выключена
+        preroll_seconds: settings.analytics_preroll_seconds || 0,
+        preroll_dir: settings.recordingsPath,
+        preroll_prefix: camera.name.replace(/[<>:"/\\|?*]/g, '_'),
+        preroll_cooldown: settings.analytics_record_duration || 30,
+        motion_gate: settings.analytics_motion_gate || false,
+        motion_threshold: settings.analytics_motion_threshold || 0.01,
+        motion_keepalive: settings.analytics_motion_keepalive || 30,
+        metrics_interval: settings.analytics_metrics_interval || 60,
+        profiler: settings.analytics_profiler || null,
+        // Снимки событий (кадр и вырезки объектов) — в кэш с ограничением по размеру
+        snapshot_dir: settings.analytics_snapshots ? path.join(app.getPath('userData'), 'analytics-snapshots') : null,
+        snapshot_prefix: `camera${cameraId}`,
+        snapshot_max_mb: settings.analytics_snapshot_max_mb || 256,
+        snapshot_format: settings.analytics_snapshot_format || 'jpg',
+        // Журнал событий: analytics.py дописывает его пакетами (см. configManager.queryEvents)
+        events_dir: configManager.getEventsStorePath(),
+        // Кадры живого просмотра, пока он открыт (см. IngestTap); иначе — rtsp_url
+        ingest_path: settings.analytics_shared_ingest ? getIngestIpcPath(cameraId) : null,
+        // Точность модели камеры (analyticsConfig.model_precision); без неё — общая настройка сервера
+        model_precision: camera.analyticsConfig?.model_precision || null,
+        // Рамки для живого просмотра: только пока он открыт и не чаще overlay_fps
+        overlay: overlayCameras.has(cameraId),
+        overlay_fps: settings.analytics_overlay_fps || 5,
     };
-    const configArg = Buffer.from(JSON.stringify(configForScript)).toString('base64');
-    
-    const providerChoice = settings.analytics_provider || 'auto';
-    console.log(`[Analytics] Starting with provider choice: ${providerChoice}`);
-    const analyticsProcess = spawn(analyticsPath, [rtspUrl, configArg, providerChoice], { windowsHide: true });
-    
-    addProcess(analyticsId, analyticsProcess, PROCESS_TYPES.ANALYTICS);
 
-    analyticsProcess.stdout.on('data', async (data) => {
-        data.toString().split('\n').filter(Boolean).forEach(async line => {
-            try {
-                const result = JSON.parse(line);
-                if (result.status === 'objects_detected' && result.objects.length > 0) {
-                    await configManager.saveAnalyticsEvent({cameraId, ...result});
-                    const labels = [...new Set(result.objects.map(o => o.label))];
-                    services.showAnalyticsNotification(camera.name, cameraId, labels);
-                    await handleAnalyticsDetection(cameraId, camera);
-                }
-                if (mainWindow && !mainWindow.isDestroyed()) {
-                    const channel = result.status === 'info' ? 'analytics-provider-info' : 'analytics-update';
-                    const payload = { cameraId, result: result };
-                    mainWindow.webContents.send(channel, payload);
-                }
-            } catch (e) {
-                console.warn(`[Analytics] Non-JSON output from script for camera ${cameraId}:`, line);
-            }
-        });
-    });
-
-    // VVVVVV --- ИЗМЕНЕНИЕ: ДОБАВЛЕН ОБРАБОТЧИК STDERR --- VVVVVV
-    // Слушаем поток ошибок. Любой вывод здесь означает критическую проблему.
-    analyticsProcess.stderr.on('data', (data) => {
-        console.error(`[Analytics STDERR] for camera ${cameraId}: ${data.toString()}`);
-        // Отправляем ошибку в интерфейс, чтобы пользователь тоже ее увидел
-        if (mainWindow && !mainWindow.isDestroyed()) {
-             mainWindow.webContents.send('on-main-error', {
-                context: `Analytics Script (camId: ${cameraId})`,
-                message: data.toString()
-            });
-        }
-    });
-    // ^^^^^^ --- КОНЕЦ ИЗМЕНЕНИЯ --- ^^^^^^
-
-    analyticsProcess.on('close', (code) => {
-        stopProcess(analyticsId);
-        if (mainWindow && !mainWindow.isDestroyed()) {
-            mainWindow.webContents.send('analytics-status-change', { cameraId, active: false });
-        }
-    });
+    if (!analyticsServer) {
+        // Камеры, включённые одновременно, дожидаются одного и того же запуска сервера
+        analyticsServerStarting ??= startAnalyticsServer(analyticsPath, settings, mainWindow)
+            .finally(() => { analyticsServerStarting = null; });
+        analyticsServer = await analyticsServerStarting;
+    }
+    analyticsServer.cameras.set(cameraId, camera);
+    sendAnalyticsCommand({ cmd: 'add_camera', camera_id: cameraId, rtsp_url: rtspUrl, config: configForScript });
 
     if (mainWindow && !mainWindow.isDestroyed()) {
         mainWindow.webContents.send('analytics-status-change', { cameraId, active: true });
@@ -418,6 +740,37 @@ async function toggleAnalytics(cameraId, mainWindow) {
     return { success: true, status: 'started' };
 }
 
+/**
+ * Передаёт работающему серверу аналитики новые настройки камеры без перезапуска.
+ * @param {number} cameraId
+ * @param {object} analyticsConfig - analyticsConfig камеры (objects и т.д.).
+ */
+function updateAnalyticsConfig(cameraId, analyticsConfig) {
+    if (!analyticsServer || !analyticsServer.cameras.has(cameraId)) {
+        return { success: false, error: 'Analytics is not running for this camera' };
+    }
+    const sent = sendAnalyticsCommand({
+        cmd: 'update_config',
+        camera_id: cameraId,
+        config: { objects: analyticsConfig?.objects || [], zones: analyticsConfig?.zones || null },
+    });
+    return { success: sent };
+}
+
+/**
+ * Включает рамки 'overlay' камеры, пока её живой просмотр открыт в сетке.
+ * @param {number} cameraId
+ * @param {boolean} visible
+ */
+function setAnalyticsOverlay(cameraId, visible) {
+    if (visible) overlayCameras.add(cameraId);
+    else overlayCameras.delete(cameraId);
+    if (analyticsServer && analyticsServer.cameras.has(cameraId)) {
+        sendAnalyticsCommand({ cmd: 'update_config', camera_id: cameraId, config: { overlay: !!visible } });
+    }
+    return { success: true };
+}
+
 async function killAllFfmpeg() {
     stopAllProcesses(); 
     const builder = new FfmpegCommandBuilder({});
@@ -426,6 +779,8 @@ async function killAllFfmpeg() {
     return new Promise(resolve => {
         exec(command, () => {
             Object.values(streamManager).forEach(s => s.wss?.close());
+            Object.values(ingestTaps).forEach(tap => tap.close());
+            Object.keys(ingestTaps).forEach(k => delete ingestTaps[k]);
             usedPorts.clear();
             Object.keys(streamManager).forEach(k => delete streamManager[k]);
             Object.keys(recordingManager).forEach(k => delete recordingManager[k]);
@@ -445,6 +800,9 @@ module.exports = {
     startRecording,
     stopRecording,
     exportArchiveClip,
+    analyzeArchive,
     toggleAnalytics,
+    updateAnalyticsConfig,
+    setAnalyticsOverlay,
     killAllFfmpeg
 };
\ No newline at end of file